@@ -0,0 +1,137 @@
+"""
+Benchmark module
+Measures throughput and peak memory of the monitor hot path on deterministic synthetic logs generated with the
+logcreator vocabulary. Results are appended as one JSON line per run so that runs can be compared over time:
+    python benchmark.py [-n NB_LINES] [--users NB_USERS] [--sections NB_SECTIONS] [--seed SEED] [-o OUTPUT]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import datastruct as dt
+import logcreator as lc
+import regex_parser as rp
+
+START = 1487094629  # timestamp of the first synthetic line: fixed so that runs are comparable
+STATS_PERIOD = 10
+ALERT_PERIOD = 120
+CALLS = 1000  # calls per timed run of the once-per-period functions: a single call is too short to be timed
+
+
+def measure(function, setup=None, runs=3):
+    """
+    Times a function several times and keeps the fastest run to reduce noise, then measures its peak memory
+    allocation in a separate run since tracing allocations slows it down
+    :param function: (callable) function to measure, takes the value returned by setup
+    :param setup: (callable) returns a fresh argument for each run, not measured - optional
+    :param runs: (int) number of timed runs
+    :return: (dict) dict.keys() = ["seconds", "peak_memory"]: duration of the fastest run, peak bytes allocated
+    """
+    best = float("inf")
+    for _ in range(runs):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        function(argument)
+        best = min(best, time.perf_counter() - start)
+    argument = setup() if setup is not None else None
+    tracemalloc.start()
+    function(argument)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": best, "peak_memory": peak_memory}
+
+
+class Benchmark:
+    """runs every benchmark on the same synthetic log"""
+
+    def __init__(self, nb_lines, seed, nb_users, nb_sections, rate):
+        self.nb_lines = nb_lines
+        lines = lc.generate_loglines(nb_lines, seed, nb_users, nb_sections, rate, START)
+        self.data = ("\n".join(lines) + "\n").encode()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "access.log")
+
+    def close(self):
+        """
+        Removes the synthetic log file
+        :return: None
+        """
+        shutil.rmtree(self.directory)
+
+    def _ready_datastruct(self):
+        """
+        :return: (Datastruct) event-time data structure whose next fill reads the whole synthetic log
+        """
+        datastruct = dt.Datastruct(ALERT_PERIOD, STATS_PERIOD, event_time=True)
+        with open(self.path, 'wb'):  # empty file: 1st fill goes to its end
+            pass
+        datastruct.fill(self.path)
+        with open(self.path, 'ab') as log_file:
+            log_file.write(self.data)
+        return datastruct
+
+    def run(self):
+        """
+        :return: (dict) {benchmark name: dict returned by measure + "lines_per_second" or "calls_per_second"}
+        """
+        results = {}
+        lines = self.data.decode().splitlines()
+        results["parse"] = measure(lambda _: [rp.parse(line) for line in lines])
+        results["parse_batch"] = measure(lambda _: rp.parse_batch(self.data))
+        results["fill"] = measure(lambda datastruct: datastruct.fill(self.path), self._ready_datastruct)
+        for name in results:
+            results[name]["lines_per_second"] = self.nb_lines / results[name]["seconds"]
+
+        filled = self._ready_datastruct()
+        filled.fill(self.path)
+
+        def compute_stats(_):
+            for _ in range(CALLS):
+                filled.compute_stats()
+        results["compute_stats"] = measure(compute_stats)
+
+        def compute_alert(_):
+            for _ in range(CALLS):
+                filled.window.advance(filled.window.head + STATS_PERIOD)  # one period of event time, then the check
+                filled.compute_alert(20, False)
+        results["compute_alert"] = measure(compute_alert)
+        for name in ("compute_stats", "compute_alert"):
+            results[name]["calls_per_second"] = CALLS / results[name]["seconds"]
+        return results
+
+
+def main(args):
+    benchmark = Benchmark(args.nb_lines, args.seed, args.nb_users, args.nb_sections, args.rate)
+    try:
+        results = benchmark.run()
+    finally:
+        benchmark.close()
+    for name, result in results.items():
+        rate = result.get("lines_per_second")
+        unit = "lines/s"
+        if rate is None:
+            rate, unit = result["calls_per_second"], "calls/s"
+        print("{:<14} {:>14,.0f} {:<8} peak memory {:>12,} bytes".format(name, rate, unit, result["peak_memory"]))
+    record = {"time": int(time.time()), "python": platform.python_version(), "machine": platform.machine(),
+              "parameters": vars(args), "results": results}
+    with open(args.output, 'a') as output:
+        output.write(json.dumps(record, sort_keys=True) + "\n")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP Monitoring benchmark')
+    parser.add_argument('-n', help='number of synthetic log lines (int)', type=int, default=200000, dest="nb_lines")
+    parser.add_argument('--seed', help='random seed (int)', type=int, default=0)
+    parser.add_argument('--users', help='number of distinct users (int)', type=int, default=6, dest="nb_users")
+    parser.add_argument('--sections', help='number of distinct sections (int)', type=int, default=3,
+                        dest="nb_sections")
+    parser.add_argument('--rate', help='lines per second of log time (int)', type=int, default=100)
+    parser.add_argument('-o', help='file where results are appended as JSON lines', default="benchmarks.jsonl",
+                        dest="output")
+    sys.exit(main(parser.parse_args()))
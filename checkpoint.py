@@ -0,0 +1,214 @@
+"""
+Checkpoint module
+Saves the state needed to restart the monitor without losing lines or alert state (position, identity and fingerprint
+of each log file, alert window, alert states and rules, cf MultiLog.get_state) in a compact binary file, and loads it
+back. The file is written next to its final path and renamed over it, so that a crash while saving leaves the
+previous checkpoint intact.
+Layout, little-endian:
+    header: magic, version, merged alert state, number of records
+    record: kind (source or merged), alert state, path length, path, Datastruct fields, hist_traffic,
+            window fields (with its length and lateness) and buckets if any
+    rules: flags, watermark, number of rules on alert and of counts, then the rules on alert (kind, key) and the
+           counts of the alert period and of the seconds not closed yet (count, second, hits, key)
+    trailer: CRC32 of everything before it
+"""
+import os
+import struct
+import zlib
+import rules as rl
+
+MAGIC = b"HMCK"
+VERSION = 3
+HEADER = struct.Struct("<4sBBI")  # magic, version, merged on_alert, number of records
+RECORD = struct.Struct("<BBH")  # kind, on_alert, length of the utf-8 path
+DATASTRUCT = struct.Struct("<BQQHIqqqII")  # flags, st_dev, st_ino, fingerprint length and CRC, position, counter,
+                                           # malformed_lines, stats_period, len(hist_traffic)
+WINDOW = struct.Struct("<IIqqqqqdI")  # length, lateness, head, watermark, total, late_hits, anchor second,
+                                      # anchor wall time, nb buckets
+RULES = struct.Struct("<BqII")  # flags, watermark, number of rules on alert, number of counts
+RULE_ON_ALERT = struct.Struct("<BH")  # index of the kind in rules.KINDS, length of the utf-8 key
+RULE_COUNT = struct.Struct("<BqQH")  # index of the count, cf rules.RuleEngine.get_state, second, hits, key length
+TRAILER = struct.Struct("<I")
+SOURCE, MERGED = 0, 1  # record kinds
+HAS_IDENTITY, HAS_WINDOW, WINDOW_STARTED, HAS_ANCHOR, HAS_FINGERPRINT = 1, 2, 4, 8, 16  # Datastruct flags
+HAS_RULES, RULES_STARTED = 1, 2  # rules flags
+
+
+def _encode_datastruct(state):
+    """
+    :param state: (dict) returned by Datastruct.get_state
+    :return: (bytes) Datastruct fields, hist_traffic and window
+    """
+    identity, window, anchor = state["identity"], state["window"], state["clock_anchor"]
+    flags = (HAS_IDENTITY if identity is not None else 0) | (HAS_WINDOW if window is not None else 0)
+    if window is not None and window["head"] is not None:
+        flags |= WINDOW_STARTED
+    if anchor is not None:
+        flags |= HAS_ANCHOR
+    if state["fingerprint"] is not None:
+        flags |= HAS_FINGERPRINT
+    dev, ino = identity if identity is not None else (0, 0)
+    length, crc = state["fingerprint"] if state["fingerprint"] is not None else (0, 0)
+    hist_traffic = state["hist_traffic"]
+    parts = [DATASTRUCT.pack(flags, dev, ino, length, crc, state["position"], state["counter"],
+                             state["malformed_lines"], state["stats_period"], len(hist_traffic)),
+             struct.pack("<{}q".format(len(hist_traffic)), *hist_traffic)]
+    if window is not None:
+        second, wall_time = anchor if anchor is not None else (0, 0.0)
+        parts.append(WINDOW.pack(window["length"], window["lateness"], window["head"] or 0, window["watermark"] or 0,
+                                 window["total"], window["late_hits"], second, wall_time, len(window["buckets"])))
+        parts.append(struct.pack("<{}q".format(len(window["buckets"])), *window["buckets"]))
+    return b"".join(parts)
+
+
+def _decode_datastruct(data, offset):
+    """
+    :param data: (bytes) checkpoint content
+    :param offset: (int) offset of the Datastruct fields
+    :return: (dict, int) state as returned by Datastruct.get_state, offset after it
+    """
+    flags, dev, ino, length, crc, position, counter, malformed_lines, stats_period, nb_hist = \
+        DATASTRUCT.unpack_from(data, offset)
+    offset += DATASTRUCT.size
+    hist_traffic = list(struct.unpack_from("<{}q".format(nb_hist), data, offset))
+    offset += 8 * nb_hist
+    window = anchor = None
+    if flags & HAS_WINDOW:
+        window_length, lateness, head, watermark, total, late_hits, second, wall_time, nb_buckets = \
+            WINDOW.unpack_from(data, offset)
+        offset += WINDOW.size
+        buckets = list(struct.unpack_from("<{}q".format(nb_buckets), data, offset))
+        offset += 8 * nb_buckets
+        started = flags & WINDOW_STARTED
+        window = {"length": window_length, "lateness": lateness, "head": head if started else None,
+                  "watermark": watermark if started else None, "total": total, "late_hits": late_hits,
+                  "buckets": buckets}
+        if flags & HAS_ANCHOR:
+            anchor = (second, wall_time)
+    state = {"identity": (dev, ino) if flags & HAS_IDENTITY else None,
+             "fingerprint": (length, crc) if flags & HAS_FINGERPRINT else None, "position": position,
+             "counter": counter, "malformed_lines": malformed_lines, "stats_period": stats_period,
+             "hist_traffic": hist_traffic, "window": window, "clock_anchor": anchor}
+    return state, offset
+
+
+def _encode_rules(state):
+    """
+    :param state: (dict) returned by rules.RuleEngine.get_state, None without rules
+    :return: (bytes) rules fields, rules on alert and counts
+    """
+    if state is None:
+        return RULES.pack(0, 0, 0, 0)
+    flags = HAS_RULES | (RULES_STARTED if state["watermark"] is not None else 0)
+    kinds = list(rl.KINDS)
+    on_alert = [(kinds.index(kind), key.encode("utf-8", "surrogateescape"))
+                for kind, keys in state["on_alert"].items() for key in keys]
+    parts = [RULES.pack(flags, state["watermark"] or 0, len(on_alert), len(state["counts"]))]
+    for kind, key in on_alert:
+        parts += [RULE_ON_ALERT.pack(kind, len(key)), key]
+    for index, second, key, hits in state["counts"]:
+        key = key.encode("utf-8", "surrogateescape")
+        parts += [RULE_COUNT.pack(index, second, hits, len(key)), key]
+    return b"".join(parts)
+
+
+def _decode_rules(data, offset):
+    """
+    :param data: (bytes) checkpoint content
+    :param offset: (int) offset of the rules fields
+    :return: (dict, int) state as returned by rules.RuleEngine.get_state - None without rules, offset after it
+    """
+    flags, watermark, nb_on_alert, nb_counts = RULES.unpack_from(data, offset)
+    offset += RULES.size
+    kinds = list(rl.KINDS)
+    on_alert = {kind: [] for kind in kinds}
+    for _ in range(nb_on_alert):
+        kind, length = RULE_ON_ALERT.unpack_from(data, offset)
+        offset += RULE_ON_ALERT.size
+        on_alert[kinds[kind]].append(data[offset:offset + length].decode("utf-8", "surrogateescape"))
+        offset += length
+    counts = []
+    for _ in range(nb_counts):
+        index, second, hits, length = RULE_COUNT.unpack_from(data, offset)
+        offset += RULE_COUNT.size
+        counts.append((index, second, data[offset:offset + length].decode("utf-8", "surrogateescape"), hits))
+        offset += length
+    if not flags & HAS_RULES:
+        return None, offset
+    return {"watermark": watermark if flags & RULES_STARTED else None, "on_alert": on_alert, "counts": counts}, offset
+
+
+def encode(state):
+    """
+    :param state: (dict) returned by MultiLog.get_state
+    :return: (bytes) binary checkpoint
+    """
+    records = [(SOURCE, path, source_state) for path, source_state in state["sources"].items()]
+    if state["merged"] is not None:
+        records.append((MERGED, "", state["merged"]))
+    parts = [HEADER.pack(MAGIC, VERSION, state["on_alert"].get(None, False), len(records))]
+    for kind, path, datastruct_state in records:
+        encoded_path = path.encode("utf-8", "surrogateescape")
+        on_alert = state["on_alert"].get(path, False) if kind == SOURCE else False
+        parts += [RECORD.pack(kind, on_alert, len(encoded_path)), encoded_path, _encode_datastruct(datastruct_state)]
+    parts.append(_encode_rules(state["rules"]))
+    data = b"".join(parts)
+    return data + TRAILER.pack(zlib.crc32(data))
+
+
+def decode(data):
+    """
+    :param data: (bytes) binary checkpoint
+    :return: (dict) state as returned by MultiLog.get_state, None if data is not a valid checkpoint
+    """
+    if len(data) < HEADER.size + TRAILER.size or TRAILER.unpack_from(data, len(data) - TRAILER.size)[0] != \
+            zlib.crc32(data[:-TRAILER.size]):
+        return None
+    magic, version, merged_on_alert, nb_records = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    state = {"sources": {}, "merged": None, "on_alert": {None: bool(merged_on_alert)}, "rules": None}
+    offset = HEADER.size
+    try:
+        for _ in range(nb_records):
+            kind, on_alert, path_length = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            path = data[offset:offset + path_length].decode("utf-8", "surrogateescape")
+            offset += path_length
+            datastruct_state, offset = _decode_datastruct(data, offset)
+            if kind == MERGED:
+                state["merged"] = datastruct_state
+            else:
+                state["sources"][path] = datastruct_state
+                state["on_alert"][path] = bool(on_alert)
+        state["rules"], offset = _decode_rules(data, offset)
+    except struct.error:  # truncated despite a matching CRC: not written by this module
+        return None
+    return state
+
+
+def save(path, state):
+    """
+    Writes a checkpoint atomically: readers see either the previous checkpoint or the new one
+    :param path: (string) checkpoint file path
+    :param state: (dict) returned by MultiLog.get_state
+    :return: None
+    """
+    temporary_path = path + ".tmp"
+    with open(temporary_path, 'wb') as checkpoint_file:
+        checkpoint_file.write(encode(state))
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())  # content is on disk before the rename makes it visible
+    os.replace(temporary_path, path)
+
+
+def load(path):
+    """
+    :param path: (string) checkpoint file path
+    :return: (dict) state as returned by MultiLog.get_state, None if there is no valid checkpoint
+    """
+    try:
+        with open(path, 'rb') as checkpoint_file:
+            return decode(checkpoint_file.read())
+    except OSError:
+        return None
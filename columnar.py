@@ -0,0 +1,212 @@
+"""
+Columnar module
+Keeps the most recent requests in a ring of typed arrays, one per field, so that questions such as "top sections over
+the last 5 minutes" or "errors of user X in the last hour" can be answered without reading the log again. Strings
+(sections, users, methods) are dictionary-encoded: each distinct value is stored once and rows hold its int id, so a
+request costs about 30 bytes whatever its content instead of a dict of Python objects.
+Values no stored row refers to anymore are dropped from time to time, so that the dictionaries are bounded by the
+rows stored and not by every value ever seen (e.g. users).
+A query builds a single mask of the matching rows, used to count hits, sum traffic and group the selected rows. Rows
+are handled slice by slice with map, zip, itertools.compress and Counter over operator functions: no Python code runs
+per row, though every row still goes through Python objects, and other threads get the interpreter back between two
+slices.
+"""
+import itertools
+import operator
+from array import array
+from collections import Counter
+
+CAPACITY = 1 << 20  # rows kept by default: about 30 MiB
+FIELDS = ("section", "user", "method")  # dictionary-encoded fields
+GROUPS = FIELDS + ("status",)  # fields rows can be grouped or filtered by
+COMPACTION_SIZE = 1 << 12  # distinct values of a field above which unreferenced ones are dropped, cf _compact
+SLICE = 1 << 16  # rows handled at once by a query
+
+
+class RequestStore:
+    """bounded ring of the most recent requests, stored column by column"""
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.size = 0  # number of rows stored, at most capacity
+        self._next = 0  # index of the row written next, the oldest row once the ring is full
+        self._seconds = array('q', [0]) * capacity  # timestamp, in seconds since epoch
+        self._ids = {field: array('I', [0]) * capacity for field in FIELDS}  # id of the value of each row
+        self._statuses = array('H', [0]) * capacity
+        self._sizes = array('Q', [0]) * capacity
+        self._encoding = {field: {} for field in FIELDS}  # {field: {value: id}}
+        self._values = {field: [] for field in FIELDS}  # {field: [value of id 0, value of id 1, ...]}
+        self._compact_at = {field: COMPACTION_SIZE for field in FIELDS}  # number of values triggering _compact
+
+    def _encode(self, field, values):
+        """
+        :param field: (string) one of FIELDS
+        :param values: (list) of strings
+        :return: (array) ids of the values, new values being given the next ids
+        """
+        encoding = self._encoding[field]
+        ids = array('I', [encoding.setdefault(value, len(encoding)) for value in values])
+        known = self._values[field]
+        if len(encoding) > len(known):  # dicts keep insertion order: new values come last
+            known.extend(itertools.islice(encoding, len(known), None))
+        return ids
+
+    def _compact(self, field):
+        """
+        Drops the values no stored row refers to anymore and renumbers the others. Next compaction happens once the
+        number of values has doubled, so that its O(capacity) cost is spread over as many new values
+        :param field: (string) one of FIELDS
+        :return: None
+        """
+        column = self._ids[field]
+        used = sorted(set(column[:self.size]))
+        new_ids = dict(zip(used, range(len(used))))  # {old id: new id}
+        column[:self.size] = array('I', map(new_ids.__getitem__, column[:self.size]))
+        values = self._values[field]
+        self._values[field] = [values[index] for index in used]
+        self._encoding[field] = {value: index for index, value in enumerate(self._values[field])}
+        self._compact_at[field] = max(COMPACTION_SIZE, 2 * len(used))
+
+    def _write(self, column, values):
+        """
+        Writes values in the ring from the next row, wrapping around at the end
+        :param column: (array) column of the ring
+        :param values: (array) of the same type, at most capacity values
+        :return: None
+        """
+        first = min(len(values), self.capacity - self._next)
+        column[self._next:self._next + first] = values[:first]
+        column[:len(values) - first] = values[first:]
+
+    def add_batch(self, batch):
+        """
+        Stores the lines of a batch, the oldest rows being overwritten once the ring is full. Lines whose timestamp is
+        malformed are not stored
+        :param batch: (regex_parser.ParsedBatch) parsed lines
+        :return: None
+        """
+        columns = (batch.seconds, batch.sections, batch.userids, batch.methods, batch.statuses, batch.sizes)
+        if None in batch.seconds:
+            kept = [second is not None for second in batch.seconds]
+            columns = [list(itertools.compress(column, kept)) for column in columns]
+        seconds, sections, users, methods, statuses, sizes = [column[-self.capacity:] for column in columns]
+        if not seconds:
+            return
+        self._write(self._seconds, array('q', seconds))
+        for field, values in zip(FIELDS, (sections, users, methods)):
+            self._write(self._ids[field], self._encode(field, values))
+        self._write(self._statuses, array('H', map(int, statuses)))
+        self._write(self._sizes, array('Q', sizes))
+        self._next = (self._next + len(seconds)) % self.capacity
+        self.size = min(self.capacity, self.size + len(seconds))
+        for field in FIELDS:
+            if len(self._values[field]) > self._compact_at[field]:
+                self._compact(field)
+
+    def copy(self):
+        """
+        :return: (RequestStore) copy of the rows stored, that other threads can query while this store is filled
+        """
+        copy = RequestStore(capacity=0)
+        copy.capacity = copy.size = self.size  # full ring: rows are in no particular order anyway
+        copy._seconds = self._seconds[:self.size]
+        copy._ids = {field: column[:self.size] for field, column in self._ids.items()}
+        copy._statuses = self._statuses[:self.size]
+        copy._sizes = self._sizes[:self.size]
+        copy._encoding = {field: dict(encoding) for field, encoding in self._encoding.items()}
+        copy._values = {field: list(values) for field, values in self._values.items()}
+        return copy
+
+    def _column(self, field):
+        """
+        :param field: (string) one of GROUPS
+        :return: (array) values (statuses) or ids of the stored rows, in no particular order
+        """
+        if field == "status":
+            return self._statuses[:self.size]
+        if field not in self._ids:
+            raise ValueError("unknown field {}, expected one of {}".format(field, GROUPS))
+        return self._ids[field][:self.size]
+
+    def _mask(self, rows, start, end, errors, conditions):
+        """
+        :param rows: (slice) of the stored rows
+        :param conditions: (list) of tuples (column, wanted id or status)
+        :return: (bytes) 1 for each row of the slice matching every condition, 0 for the others - None if every row
+                 matches
+        """
+        tests = []
+        if start is not None:
+            tests.append(map(operator.le, itertools.repeat(start), self._seconds[rows]))
+        if end is not None:
+            tests.append(map(operator.gt, itertools.repeat(end), self._seconds[rows]))
+        for column, wanted in conditions:
+            tests.append(map(operator.eq, column[rows], itertools.repeat(wanted)))
+        if errors:
+            tests.append(map(operator.le, itertools.repeat(400), self._statuses[rows]))
+        if not tests:
+            return None
+        return bytes(tests[0] if len(tests) == 1 else map(all, zip(*tests)))
+
+    def query(self, group_by=None, start=None, end=None, errors=False, **filters):
+        """
+        Counts and sums the stored requests of a sub-window matching some conditions, e.g.
+        query("section", start=now - 300) or query("section", start=now - 3600, errors=True, user="frank")
+        :param group_by: (string) one of GROUPS, None not to group
+        :param start: (int) first second counted, in seconds since epoch - optional
+        :param end: (int) second after the last one counted - optional
+        :param errors: (bool) only counts 4xx and 5xx statuses
+        :param filters: field=value conditions, field being one of GROUPS
+        :return: (int, int, Counter) hits, bytes sent and {value: hits} if group_by is given (empty otherwise), cf
+                 Counter.most_common
+        """
+        grouped = self._column(group_by) if group_by is not None else None  # raises ValueError for an unknown field
+        conditions = []
+        for field, value in filters.items():
+            column = self._column(field)
+            wanted = int(value) if field == "status" else self._encoding[field].get(value)
+            if wanted is None:  # value never seen: no row matches
+                return 0, 0, Counter()
+            conditions.append((column, wanted))
+        hits, traffic, counts = 0, 0, Counter()
+        for first in range(0, self.size, SLICE):
+            rows = slice(first, min(first + SLICE, self.size))
+            mask = self._mask(rows, start, end, errors, conditions)
+            if mask is None:
+                hits += rows.stop - rows.start
+                traffic += sum(self._sizes[rows])
+                if grouped is not None:
+                    counts.update(grouped[rows])
+                continue
+            hits += mask.count(1)
+            traffic += sum(itertools.compress(self._sizes[rows], mask))
+            if grouped is not None:
+                counts.update(itertools.compress(grouped[rows], mask))
+        if group_by is None or group_by == "status":
+            return hits, traffic, counts
+        values = self._values[group_by]
+        return hits, traffic, Counter({values[index]: count for index, count in counts.items()})
+
+    def count(self, group_by=None, start=None, end=None, errors=False, **filters):
+        """
+        Counts the stored requests of a sub-window matching some conditions, cf query
+        :return: (Counter) {value: hits} - (int) number of hits if group_by is None
+        """
+        hits, _, counts = self.query(group_by, start, end, errors, **filters)
+        return counts if group_by is not None else hits
+
+    def traffic(self, start=None, end=None, errors=False, **filters):
+        """
+        Sums the response sizes of the stored requests of a sub-window matching some conditions, cf query
+        :return: (int) bytes
+        """
+        return self.query(None, start, end, errors, **filters)[1]
+
+    def time_range(self):
+        """
+        :return: (int, int) oldest and most recent timestamps stored, None if the store is empty
+        """
+        if self.size == 0:
+            return None
+        seconds = self._seconds[:self.size]
+        return min(seconds), max(seconds)
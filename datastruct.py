@@ -1,51 +1,241 @@
 import regex_parser as rp
+import tailer as tl
+import window as wd
+import topk
+import shard as sh
+import histogram as hg
+import columnar as cl
+import metrics as mt
+import time
 from collections import Counter  # dict subclass more efficient to count hashable objects
 from collections import deque    # list-like container with fast appends and pops on either end
 
 class Datastruct:
     """data structure designed to store new log lines in a log files for efficient access to relevant statistics"""
 
-    def __init__(self, alert_period, stats_period):
+    CATCH_UP_SIZE = 64 << 20  # unread bytes above which fill parses in parallel, if workers are available
+
+    def __init__(self, alert_period, stats_period, event_time=False, lateness=None, top_k=None, workers=None,
+                 history=None):
         self._pos_in_file = 0  # used to store last position in file
-        self._pos_offset = 2  # used for 1st iteration, to go to end of file and disregard log file content when we start
-        self._last_sections = Counter()  # {section: hits} during last period
-        self._last_users = Counter()  # {userid: hits} during last period
-        self._last_errors = Counter()  # {section: nb of errors} during last periods
+        self._tailer = None  # follows the log file between calls to fill, created on 1st call
+        counter = Counter if not top_k else lambda: topk.SpaceSaving(top_k)  # exact or bounded-memory counting
+        self._last_sections = counter()  # {section: hits} during last period
+        self._last_users = counter()  # {userid: hits} during last period
+        self._last_errors = counter()  # {section: nb of errors} during last periods
         self.last_hits = 0  # number of hits during last period
         self.last_traffic = 0 # bytes traffic during last period
+        self._last_sizes = hg.LogHistogram()  # response sizes during last period
+        self._last_section_sizes = hg.KeyedHistograms()  # {section: response sizes} during last period
+        self.malformed_lines = 0  # historic number of lines that were not W3C formated
         self.hist_traffic = deque()  # used to keep traffic information on a longer timeframe to monitor peaks
         self.counter = 0 # historic number of monitoring periods - for display purposes
         self.alert_period = alert_period
         self.stats_period = stats_period
+        self.window = None  # event-time alerting: hits per second of log timestamps instead of hits per period
+        if event_time:
+            self.window = wd.EventWindow(alert_period, stats_period if lateness is None else lateness)
+        self._clock_anchor = None  # (event second, wall time) when event time last moved forward
+        self._held = None  # {second: hits} waiting for release_window, when event time is driven by other Datastructs
+        self.workers = workers  # number of processes used to catch up on a large backlog, None to stay sequential
+        self.history = cl.RequestStore(history) if history else None  # last requests kept for drill-down queries
+        self.rules = None  # rules.RuleEngine counting every line read, cf MultiLog
+        self.metrics = mt.Metrics()  # self-instrumentation, shared by the Datastructs of a MultiLog
+
+    def fill_with_batch(self, batch):
+        """
+        Takes a batch of parsed lines and fills relevant fields of data structure
+        :param batch: (regex_parser.ParsedBatch): parsed lines
+        :return: None
+        """
+        self._last_sections.update(batch.sections)  # Counter.update counts an iterable in C
+        self._last_users.update(batch.userids)
+        self.last_hits += len(batch.sizes)
+        self.last_traffic += sum(batch.sizes)
+        indexes = hg.bucket_indexes(batch.sizes)
+        self._last_sizes.add_indexes(indexes, max(batch.sizes, default=None))
+        self._last_section_sizes.add_indexes(batch.sections, indexes, batch.sizes)
+        self._last_errors.update(section for section, status in zip(batch.sections, batch.statuses)
+                                 if status[0] in "45")  # it's an error code
+        self.malformed_lines += batch.malformed
+        if self.history is not None:
+            self.history.add_batch(batch)
+        if self.rules is not None:
+            self.rules.add_batch(batch)
+        if self.window is not None:
+            per_second = Counter(batch.seconds)
+            per_second.pop(None, None)  # malformed timestamp: counted in stats, not in the alert window
+            self._fill_window(per_second)
+
+    def fill_with_shard(self, shard):
+        """
+        Takes the partial counters of a shard aggregated by another process and fills relevant fields of data structure.
+        The lines of a shard can't be stored in history, fill doesn't read shards when history is kept
+        :param shard: (shard.ShardResult): partial counters
+        :return: None
+        """
+        self._last_sections.update(shard.sections)
+        self._last_users.update(shard.users)
+        self._last_errors.update(shard.errors)
+        self.last_hits += shard.hits
+        self.last_traffic += shard.traffic
+        self._last_sizes.merge(shard.sizes)
+        self._last_section_sizes.merge(shard.section_sizes)
+        self.malformed_lines += shard.malformed
+        if self.rules is not None and shard.rule_counts is not None:
+            self.rules.add_counts(*shard.rule_counts)
+        if self.window is not None:
+            self._fill_window(shard.seconds)
+
+    def _fill_window(self, per_second):
+        """
+        Counts hits in the alert window, in time order
+        :param per_second: (dict) {second since epoch: hits}
+        :return: None
+        """
+        if self._held is not None:
+            self._held.update(per_second)
+            return
+        head = self.window.head
+        for second in sorted(per_second):
+            self.window.add(second, per_second[second])
+        if self.window.head != head:
+            self._clock_anchor = (self.window.head, time.time())
+
+    def hold_window(self):
+        """
+        Lets other Datastructs drive event time: hits are held until release_window is called with a watermark past
+        their second, instead of moving the window forward as they are read. Used to merge several log files, so that
+        a log file behind the others doesn't see its hits dropped as late
+        :return: None
+        """
+        if self.window is not None:
+            self._held = Counter()
+
+    def release_window(self, watermark):
+        """
+        Counts the held hits up to a watermark in the alert window and closes every second up to it
+        :param watermark: (int) last second closed by every Datastruct driving event time
+        :return: None
+        """
+        head = self.window.head
+        for second in sorted(second for second in self._held if second <= watermark):
+            self.window.add(second, self._held.pop(second))
+        self.window.advance(watermark + self.window.lateness + 1)
+        if self.window.head != head:
+            self._clock_anchor = (self.window.head, time.time())
 
-    def _fill_with_parsed(self, parsed_line):
+    def advance_clock(self, now=None):
         """
-        Takes a parsed line and fills relevant fields of data structure
-        :param parsed_line: (dict): a parsed line
+        Moves event time forward while no line is written, so that seconds without traffic are closed and recoveries
+        are detected. Event time moves at wall clock speed from the last timestamp read: log timestamps don't have to
+        be in sync with the local clock.
+        :param now: (float) wall clock time, time.time() if None
         :return: None
         """
-        self._last_sections[parsed_line["section"]] += 1
-        self._last_users[parsed_line["userid"]] += 1
-        self.last_hits += 1
-        self.last_traffic += parsed_line["size"]
-        if str(parsed_line["status"]).startswith(("4", "5")):  # it's an error code
-            self._last_errors[parsed_line["section"]] += 1
+        if self.window is None or self._clock_anchor is None:
+            return
+        if now is None:
+            now = time.time()
+        second, wall_time = self._clock_anchor
+        self.window.advance(second + int(now - wall_time))
 
-    def fill(self, log_file):
+    def fill(self, log_file, merged=None):
         """
         Takes a path to a log file and fills relevant fields of data structure
         :param log_file: (string) path to the log file
+        :param merged: (Datastruct) also filled with the lines read, to merge several log files - optional
         :return: None
         """
-        with open(str(log_file), 'r') as log_file:
-            log_file.seek(self._pos_in_file, self._pos_offset)  # 1st call: it goes to the end. Otherwise, to pos_in_file
-            self._pos_offset = 0
-            line = log_file.readline()
-            while line != "":
-                parsed_line = rp.parse(line)
-                self._fill_with_parsed(parsed_line)
-                line = log_file.readline()
-            self._pos_in_file = log_file.tell()
+        if self._tailer is None or self._tailer.path != str(log_file):
+            if self._tailer is not None:
+                self._tailer.close()
+            self._tailer = tl.Tailer(log_file)  # 1st call: it goes to the end and disregards log file content
+        metrics = self.metrics
+        stages = metrics.stages
+        # shards only hold counters: a backlog whose lines must be stored in history is read sequentially
+        stored = self.history is not None or (merged is not None and merged.history is not None)
+        unread = self._tailer.unread_range() if self.workers and not stored else None
+        shards = None  # parallel catch-up, None if the backlog is read sequentially
+        if unread is not None and unread[1] - unread[0] >= self.CATCH_UP_SIZE:  # large backlog: parse in parallel
+            with stages["parse"]:  # tail, parse and aggregate in worker processes
+                ruled = self.rules is not None or (merged is not None and merged.rules is not None)
+                shards = sh.aggregate_range(self._tailer.path, unread[0], unread[1], self.workers,
+                                            self._tailer.identity, self._tailer.fingerprint, by_second=ruled)
+        if shards is not None:
+            with stages["aggregate"]:
+                for shard in shards:
+                    self.fill_with_shard(shard)
+                    if merged is not None:
+                        merged.fill_with_shard(shard)
+            metrics.bytes += shards[-1].end - unread[0]
+            metrics.lines += sum(shard.hits + shard.malformed for shard in shards)
+            metrics.malformed_lines += sum(shard.malformed for shard in shards)
+            self._tailer.skip_to(shards[-1].end)
+        chunks = self._tailer.read_chunks()
+        while True:
+            with stages["tail"]:  # the tailer reads when asked for its next chunk
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            with stages["parse"]:
+                batch = rp.parse_batch(chunk)
+            with stages["aggregate"]:
+                self.fill_with_batch(batch)
+                if merged is not None:
+                    merged.fill_with_batch(batch)
+            metrics.count_batch(len(chunk), batch)
+        self._pos_in_file = self._tailer.pos_in_file
+
+    def bytes_behind(self):
+        """
+        :return: (int) bytes written to the log file that have not been read yet
+        """
+        unread = self._tailer.unread_range() if self._tailer is not None else None
+        return unread[1] - unread[0] if unread is not None else 0
+
+    def get_state(self):
+        """
+        Returns the state needed to resume monitoring after a restart without reading the log file again: position in
+        the log file and alert window. Statistics of the current period are not part of it
+        :return: (dict): dict.keys() = ["identity", "fingerprint", "position", "counter", "malformed_lines",
+                                        "stats_period", "hist_traffic", "window", "clock_anchor"]. identity is
+                                        (st_dev, st_ino) of the log file and fingerprint that of its beginning, None
+                                        if it hasn't been opened, window is EventWindow.get_state() or None
+        """
+        identity = self._tailer.identity if self._tailer is not None else None
+        fingerprint = self._tailer.fingerprint if self._tailer is not None else None
+        return {"identity": identity, "fingerprint": fingerprint, "position": self._pos_in_file,
+                "counter": self.counter, "malformed_lines": self.malformed_lines, "stats_period": self.stats_period,
+                "hist_traffic": list(self.hist_traffic),
+                "window": self.window.get_state() if self.window is not None else None,
+                "clock_anchor": self._clock_anchor}
+
+    def resume(self, log_file, state):
+        """
+        Restores a state returned by get_state, before the 1st call to fill. The alert window is restored whatever
+        the log file if it has the same length and lateness, and the traffic history if periods have the same length.
+        Reading resumes at the saved position if the log file is the same one or if it can be found among its rotated
+        segments, otherwise fill goes to the end of the log file as usual
+        :param log_file: (string) path to the log file, None for a merged Datastruct that doesn't read any
+        :param state: (dict) returned by get_state
+        :return: (bool) True if reading resumes at the saved position
+        """
+        self.counter = state["counter"]
+        self.malformed_lines = state["malformed_lines"]
+        if state["stats_period"] == self.stats_period:  # traffic of periods of another length is meaningless here
+            self.hist_traffic = deque(state["hist_traffic"][-(self.alert_period // self.stats_period):])
+        if self.window is not None and state["window"] is not None and self.window.set_state(state["window"]):
+            self._clock_anchor = state["clock_anchor"]  # event time goes on from the last timestamp saved
+        if log_file is None or state["identity"] is None:  # merged Datastruct, or log file not opened at the time
+            return False
+        if self._tailer is not None:
+            self._tailer.close()
+        self._tailer = tl.Tailer(log_file)
+        if not self._tailer.resume(state["identity"], state["position"], state["fingerprint"]):
+            return False
+        self._pos_in_file = self._tailer.pos_in_file
+        return True
 
     def clear_last(self):
         """
@@ -61,24 +251,46 @@ class Datastruct:
         self._last_sections.clear()                                 # we empty data related to previous period
         self._last_users.clear()
         self.last_hits = 0
+        self.last_traffic = 0
+        self._last_sizes.clear()
+        self._last_section_sizes.clear()
         self._last_errors.clear()
 
     def compute_stats(self):
         """
-        Returns a dictionary containing top 3 sections, users and error-filled sections by number of hits
-        :return: (dict): dict.keys() = ["top_sections", "top_users", "errors"]
+        Returns a dictionary containing top 3 sections, users and error-filled sections by number of hits, and
+        percentiles of response sizes (bytes), globally and for the top 3 sections
+        :return: (dict): dict.keys() = ["top_sections", "top_users", "errors", "size_percentiles",
+                                        "top_section_sizes"]. Percentiles are dicts: keys = ["p50", "p95", "p99"]
         """
         top_sections = self._last_sections.most_common(3) # returns a list of tuples ordered by occurences
         top_users = self._last_users.most_common(3)
         errors = self._last_errors.most_common(3)
-        return {"top_sections": top_sections, "top_users": top_users, "errors": errors}
+        size_percentiles = self._last_sizes.percentiles()
+        top_section_sizes = [(section, self._last_section_sizes.percentiles(section)) for section, _ in top_sections]
+        return {"top_sections": top_sections, "top_users": top_users, "errors": errors,
+                "size_percentiles": size_percentiles, "top_section_sizes": top_section_sizes}
+
+    def snapshot(self):
+        """
+        Returns a copy of last period statistics that doesn't share any state with the data structure, so that it can
+        be handed to another thread. Has to be called before clear_last()
+        :return: (dict): compute_stats() keys + ["counter", "last_hits", "last_traffic", "malformed_lines", "debit"]
+        """
+        snapshot = self.compute_stats()
+        snapshot.update(counter=self.counter, last_hits=self.last_hits, last_traffic=self.last_traffic,
+                        malformed_lines=self.malformed_lines, debit=self.compute_debit())
+        return snapshot
 
     def compute_debit(self, decimals=2):
         """
         Computes mean number of hits per second on past alert_period and rounds it.
+        In event-time mode, the window ends at the last closed second.
         :param decimals: (int) number of decimals to keep
         :return: (float) average number of hits on past alert period (avg is computed per second)
         """
+        if self.window is not None:
+            return round(float(self.window.total) / self.alert_period, decimals)
         average = float(sum(self.hist_traffic)) / max(1, self.alert_period // self.stats_period)
         debit = average / self.stats_period
         return round(debit, decimals)
@@ -103,7 +315,13 @@ class Datastruct:
         :param on_alert: (boolean) current alert state
         :return: (bool, dict) : bool: on_alert value, current alert state.
                                 dict.keys() = [status_code, debit]. 1 for new alert, 0 for recovery, 2 for no change
+                                In event-time mode, only the last transition is returned, cf compute_alerts
         """
+        if self.window is not None:
+            on_alert, transitions = self.compute_alerts(alert_treshold, on_alert)
+            if transitions:
+                return on_alert, transitions[-1]
+            return on_alert, {"status_code": 2, "debit": None}
         alert_info = {}
         if not on_alert:
             if self._is_alert(alert_treshold):
@@ -118,3 +336,26 @@ class Datastruct:
         alert_info["status_code"] = 2
         alert_info["debit"] = None
         return on_alert, alert_info
+
+    def compute_alerts(self, alert_treshold, on_alert):
+        """
+        Takes a treshold and the current alert state and returns every alert start or recover since last call. In
+        event-time mode, the alert state is checked for each second closed since last call so that transitions are
+        detected at the exact second they happened, however many seconds the call covers.
+        :param alert_treshold: (int) in hits/second
+        :param on_alert: (boolean) current alert state
+        :return: (bool, list) : bool: on_alert value, current alert state.
+                                list of dict as returned by compute_alert, for status codes 1 and 0 only. In event-time
+                                mode, dict.keys() = [status_code, debit, time], time being the second (since epoch)
+                                of the transition
+        """
+        if self.window is None:
+            on_alert, alert_info = self.compute_alert(alert_treshold, on_alert)
+            return on_alert, [alert_info] if alert_info["status_code"] != 2 else []
+        transitions = []
+        for second, total in self.window.pop_closed():
+            debit = float(total) / self.alert_period
+            if (debit >= alert_treshold) != on_alert:
+                on_alert = not on_alert
+                transitions.append({"status_code": int(on_alert), "debit": round(debit), "time": second})
+        return on_alert, transitions
@@ -1,8 +1,9 @@
 import curses
+from collections import deque
 from contextlib import redirect_stdout
 import time
 import os
-import sys
+import metrics as mt
 
 
 def hacked_print(string):
@@ -35,6 +36,11 @@ def center_string_box(string, x_start, x_end):
 
 
 class Display:
+    """
+    Curses display: statistics of the last period on the left, history of alerts on the right. What is shown is kept
+    in memory (last snapshot and a bounded history of alerts) and each window only rewrites the lines that changed
+    since its last refresh, so that the screen can be laid out again from memory when the terminal is resized.
+    """
     HEADER_1 = "Statistics of the last period:"
     HEADER_2 = "History of traffic alerts:"
     STATS_INIT = "Please wait for first monitoring period to end."
@@ -45,126 +51,257 @@ class Display:
     STATS_SECTION3 = "Top 3 users: "
     STATS_SECTION4 = "Top 3 sections with most errors: "
     STATS_SECTION5 = "Total traffic on period (bytes):"
+    STATS_SECTION6 = "Hits per log file: "
+    STATS_SECTION7 = "Response size p50/p95/p99 (bytes): {p50}/{p95}/{p99}"
+    SECTION_SIZE = " (p95: {p95}B)"
     Q_TO_EXIT = "Press 'q' to end monitoring and return to terminal window"
-    HIGH_TRAFFIC_TEMPLATE = "High traffic generated an alert - Hits/s: {:.0f}"
-    RECOVER = "Recovered at: {}, hits/s: {:.0f}"
-    GETCH_REFRESH_MS = 20 # we check if "q" is pressed by user every GETCH_REFRESH_MS milliseconds to be responsive
+    KEYS_HELP = " - 'm': show/hide monitor metrics, 'd': dump them"
+    HEADER_METRICS = "Monitor metrics of the last period:"
+    METRICS_WAIT = "Metrics are available at the end of the period."
+    METRICS_INGEST = "Ingest: {lines_per_second:,.0f} lines/s, {bytes_per_second:,.0f} bytes/s"
+    METRICS_TOTALS = "Read: {lines:,} lines, {malformed_lines:,} malformed"
+    METRICS_BEHIND = "Behind end of files: {bytes_behind:,} bytes"
+    METRICS_DROPPED = "Snapshots dropped by the display: {dropped_snapshots:,}"
+    METRICS_STAGES = "Stage      busy    calls   max (ms)"
+    METRICS_STAGE = "{:<9} {:>5.1%} {:>8,} {:>10.1f}"
+    METRICS_DUMPED = "Metrics appended to {}"
+    TOO_SMALL = "Terminal too small, please enlarge it"
+    HIGH_TRAFFIC_TEMPLATE = "High traffic generated an alert - {}: {:.0f}"
+    TRIGGERED = "Triggered at: {}"
+    RECOVER = "Recovered at: {}, {}: {:.0f}"
+    EARLIER_ALERT = "High traffic alert raised before the alerts shown"
+    BOX_WIDTH = 59  # maximum width of a box, they shrink with the terminal
+    MIN_BOX_WIDTH = 30
+    MIN_BOX_HEIGHT = 12
+    ALERT_HISTORY = 1000  # number of alerts kept in memory, older ones are forgotten
+    FRAME_MS = 100 # the display is refreshed at most once every FRAME_MS milliseconds
+    GETCH_REFRESH_MS = 20 # if stdin can't be waited on, we check if "q" is pressed every GETCH_REFRESH_MS milliseconds
 
-    def __init__(self, myscreen):
+    def __init__(self, myscreen, metrics_path="metrics.jsonl"):
+        """
+        :param myscreen: (curses.window) whole screen
+        :param metrics_path: (string) file where metrics are appended when "d" is pressed
+        """
+        self.myscreen = myscreen
+        self.metrics_path = metrics_path
+        self.metrics = mt.Metrics(stages=("render",))  # the display thread's own stage
+        self._show_metrics = False  # the statistics window shows the monitor metrics instead
+        self.box1 = None  # statistics window, None if the terminal is too small
+        self.box2 = None  # alerts window
+        self._rendered = {}  # {window: {row: text}} what each window currently shows
+        self._snapshot = None  # last snapshot displayed
+        self._alerts = deque(maxlen=self.ALERT_HISTORY)  # [message, triggered line, recovered line, source]
         try:
             curses.curs_set(0)                                      # set cursor invisible
-            self.myscreen = myscreen
-            self.box1 = curses.newwin(43, 59, 1, 1)
-            self.box2 = curses.newwin(43, 59, 1, 60)
-            self.box1.box()
-            self.box2.box()
-            self.box1.addstr(1, center_string_box(self.HEADER_1, 1, 1 + 59), self.HEADER_1)
-            self.box2.addstr(1, center_string_box(self.HEADER_2, 60, 60 + 59), self.HEADER_2)
-            self.myscreen.addstr(45, 2, self.Q_TO_EXIT)
-            self._refresh_screen()
-        except curses.error:    # we have to go back to console environment and ask user to resize window
-            myscreen.erase()    # not pretty but couldn't figure any other way to recover from error & print
-            myscreen.refresh()  # without displaying stack trace. I don't have resize function in my curses porting to
-            myscreen.keypad(0)  # Windows.
-            curses.echo()
-            curses.nocbreak()
-            curses.endwin()
-            sys.exit("Please resize terminal window to full screen & retry \nThank you")
-
-    def _refresh_screen(self):
-        """
-        Refresh the screen to display new elements and remove older
+        except curses.error:  # not supported by the terminal
+            pass
+        self._layout()
+
+    def _layout(self):
+        """
+        Creates the windows for the current terminal size and draws everything from memory
+        :return: None
+        """
+        rows, cols = self.myscreen.getmaxyx()
+        width = min(self.BOX_WIDTH, (cols - 2) // 2)
+        height = rows - 3
+        self.myscreen.erase()
+        self._rendered = {}
+        if width < self.MIN_BOX_WIDTH or height < self.MIN_BOX_HEIGHT:
+            self.box1 = self.box2 = None
+            self.myscreen.addstr(0, 0, self.TOO_SMALL[:max(0, cols - 1)])
+            self.myscreen.noutrefresh()
+            curses.doupdate()
+            return
+        self.box1 = curses.newwin(height, width, 1, 1)
+        self.box2 = curses.newwin(height, width, 1, 1 + width)
+        header_1 = self.HEADER_METRICS if self._show_metrics else self.HEADER_1
+        for box, header in ((self.box1, header_1), (self.box2, self.HEADER_2)):
+            box.box()
+            box.addstr(1, center_string_box(header, 0, width), header)
+            self._rendered[box] = {}
+        self.myscreen.addstr(rows - 1, 2, (self.Q_TO_EXIT + self.KEYS_HELP)[:cols - 3])
+        self.myscreen.noutrefresh()
+        self._render()
+
+    def _footer(self, text):
+        """
+        Replaces the help line at the bottom of the screen
+        :param text: (string)
+        :return: None
+        """
+        if self.box1 is None:
+            return
+        rows, cols = self.myscreen.getmaxyx()
+        self.myscreen.addstr(rows - 1, 2, text[:cols - 3].ljust(cols - 3))
+        self.myscreen.noutrefresh()
+        curses.doupdate()
+
+    def _render(self):
+        """
+        Rewrites the lines of each window that changed and updates the terminal once
+        :return: None
+        """
+        if self.box1 is None:
+            return
+        with self.metrics.stages["render"]:
+            self._draw(self.box1, self._metrics_rows() if self._show_metrics else self._stats_rows())
+            self._draw(self.box2, self._alert_rows())
+            curses.doupdate()
+
+    def _draw(self, box, rows):
+        """
+        Writes the rows of a window that differ from what it shows
+        :param box: (curses.window) window to update
+        :param rows: (dict) {row: text} what the window has to show inside its borders
         :return: None
         """
-        self.myscreen.refresh()
-        self.box1.refresh()
-        self.box2.refresh()
+        rendered = self._rendered[box]
+        width = box.getmaxyx()[1] - 2
+        changed = False
+        for row in set(rendered) | set(rows):
+            text = rows.get(row, "")
+            if rendered.get(row, "") != text:
+                box.addstr(row, 1, text[:width].ljust(width))  # padding erases what was longer
+                changed = True
+        self._rendered[box] = rows
+        if changed:
+            box.noutrefresh()
+
+    def _stats_rows(self):
+        """
+        Lays out last period statistics in the statistics window: lines are spaced out if there is enough room
+        :return: (dict) {row: text}
+        """
+        snapshot = self._snapshot
+        if snapshot is None or snapshot["counter"] == 0:
+            lines = [(3, 2, self.STATS_INIT)]
+        elif snapshot["last_hits"] == 0:
+            lines = [(3, 2, self.STATS_SECTION0 + str(snapshot["counter"])), (3, 2, self.STATS_NOTRAFFIC)]
+        else:
+            lines = [(3, 2, self.STATS_SECTION0 + str(snapshot["counter"])),
+                     (3, 2, self.STATS_SECTION1 + str(snapshot["last_hits"])),
+                     (3, 2, self.STATS_SECTION2)]  # (rows from previous line when spaced out, indent, text)
+            for index, (section, hits) in enumerate(snapshot["top_sections"]):
+                sizes = self.SECTION_SIZE.format(**snapshot["top_section_sizes"][index][1])
+                lines.append((2, 4, str(index + 1) + "." + section + ":" + str(hits) + sizes))
+            lines.append((3, 2, self.STATS_SECTION3))
+            for index, (user, hits) in enumerate(snapshot["top_users"]):
+                lines.append((2, 4, str(index + 1) + "." + user + ":" + str(hits)))
+            lines.append((3, 2, self.STATS_SECTION4))
+            for index, (error, hits) in enumerate(snapshot["errors"]):
+                lines.append((2, 4, str(index + 1) + "." + error + ":" + str(hits)))
+            lines.append((3, 2, self.STATS_SECTION5 + str(snapshot["last_traffic"])))
+            lines.append((1, 2, self.STATS_SECTION7.format(**snapshot["size_percentiles"])))
+        if snapshot is not None and snapshot.get("source_hits"):
+            per_source = " ".join("{}:{}".format(os.path.basename(path), hits)
+                                  for path, hits in snapshot["source_hits"].items())
+            lines.append((1, 2, self.STATS_SECTION6 + per_source))
+        last_row = self.box1.getmaxyx()[0] - 2
+        if 2 + sum(gap for gap, _, _ in lines) > last_row:  # not enough room: compact layout
+            lines = [(min(gap, 1 if indent == 4 else 2), indent, text) for gap, indent, text in lines]
+        rows = {}
+        row = 2
+        for gap, indent, text in lines:
+            row += gap
+            if row > last_row:
+                break
+            rows[row] = " " * (indent - 1) + text
+        return rows
+
+    def _metrics_rows(self):
+        """
+        Lays out the metrics of the last period in the statistics window
+        :return: (dict) {row: text}
+        """
+        metrics = self._snapshot.get("metrics") if self._snapshot is not None else None
+        if metrics is None:
+            return {4: " " + self.METRICS_WAIT}
+        lines = [self.METRICS_INGEST.format(**metrics), self.METRICS_TOTALS.format(**metrics),
+                 self.METRICS_BEHIND.format(**metrics), self.METRICS_DROPPED.format(**metrics), "",
+                 self.METRICS_STAGES]
+        for stage, timer in metrics["stages"].items():
+            lines.append(self.METRICS_STAGE.format(stage, timer["busy"], timer["calls"], timer["max_ms"]))
+        last_row = self.box1.getmaxyx()[0] - 2
+        return {row: " " + text for row, text in enumerate(lines, 4) if text and row <= last_row}
+
+    def _alert_rows(self):
+        """
+        Lays out the most recent alerts in the alerts window, oldest ones being scrolled out
+        :return: (dict) {row: text}
+        """
+        first_row, last_row = 3, self.box2.getmaxyx()[0] - 2
+        lines = []
+        for index in range(len(self._alerts) - 1, -1, -1):  # from the most recent alert, as long as there is room
+            message, triggered, recovered, _ = self._alerts[index]
+            lines[:0] = [message, triggered, recovered, ""]
+            if len(lines) >= last_row - first_row + 1:
+                break
+        lines = lines[-(last_row - first_row + 1):]
+        return {first_row + offset: "   " + text for offset, text in enumerate(lines) if text}
 
-    def loop_exit_on_q(self, stats_period):
+    def exit_on_q(self):
         """
-        Close curses application & go back to console environnement on key pressed ("q")
-        :param stats_period: (int) duration (seconds) of the stats monitoring period
-        :return:
+        Close curses application & go back to console environnement if key "q" has been pressed, lays the screen out
+        again if the terminal has been resized, shows or hides the metrics panel on "m" and dumps the metrics of the
+        last period on "d". Does not wait: it is called by the event loop when stdin is readable
+        (or every GETCH_REFRESH_MS where stdin can't be waited on)
+        :return: (int) 1 if the user asked to exit, None otherwise
         """
-        start_time = time.time()            # This is the only way I managed to make a curse application with
-        while time.time() - start_time <= stats_period:   # screen refreshing exit on key pressed: make window.getch()
-            key = self.myscreen.getch()     # non blocking with curses.nodelay(1) (otherwise main loop is interrupted)
-            if key == ord('q'):             # and check it every [10-50]ms to be responsive.
+        key = self.myscreen.getch()         # non blocking with curses.nodelay(1)
+        while key != -1:
+            if key == ord('q'):
                 curses.endwin()
                 hacked_print("Monitoring ended by user") # cf hacked_print method
                 return 1
-            curses.napms(self.GETCH_REFRESH_MS)
+            if key == curses.KEY_RESIZE:
+                curses.update_lines_cols()
+                self._layout()
+            elif key == ord('m'):
+                self._show_metrics = not self._show_metrics
+                self._layout()
+            elif key == ord('d') and self._snapshot is not None and "metrics" in self._snapshot:
+                mt.dump(self._snapshot["metrics"], self.metrics_path)
+                self._footer(self.METRICS_DUMPED.format(self.metrics_path))
+            key = self.myscreen.getch()
 
-    def update_stats(self, datastruct):
+    def update_stats(self, snapshot):
         """
         Displays last period stats on screen
-        :param datastruct: (Datastruct)
+        :param snapshot: (dict) dict returned by Datastruct.snapshot() or MultiLog.snapshot(), with the metrics of
+                         the ingest thread if any
         :return: None
         """
-        counter = datastruct.counter
-        stats_dict = datastruct.compute_stats()
-        if counter == 0:
-            self.box1.addstr(5, 2, self.STATS_INIT)
-        else:
-            self.box1.move(2, 1)
-            self.box1.clrtobot()
-            self.box1.box()
-            if datastruct.last_hits == 0:
-                self.box1.addstr(5, 2, self.STATS_SECTION0 + str(datastruct.counter))
-                self.box1.addstr(8, 2, self.STATS_NOTRAFFIC)
-            else:
-                self.box1.addstr(5, 2, self.STATS_SECTION0 + str(datastruct.counter))
-                self.box1.addstr(8, 2, self.STATS_SECTION1 + str(datastruct.last_hits))
-                self.box1.addstr(11, 2, self.STATS_SECTION2)
-                for index, (section, hits) in enumerate(stats_dict["top_sections"]):
-                    self.box1.addstr(13+2*index, 4, str(index + 1) + "." + section + ":" + str(hits))
-                self.box1.addstr(20, 2, self.STATS_SECTION3)
-                for index, (user, hits) in enumerate(stats_dict["top_users"]):
-                    self.box1.addstr(22+2*index, 4, str(index + 1) + "." + user + ":" + str(hits))
-                self.box1.addstr(29, 2, self.STATS_SECTION4)
-                for index, (error, hits) in enumerate(stats_dict["errors"]):
-                    self.box1.addstr(31+2*index, 4, str(index + 1) + "." + error + ":" + str(hits))
-                self.box1.addstr(38, 2, self.STATS_SECTION5 + str(datastruct.last_traffic))
-        self._refresh_screen()
-
-    def update_alerts(self, display_dict):
+        if "metrics" in snapshot:  # the render stage is measured over the same period as ingest stages
+            snapshot["metrics"]["stages"].update(self.metrics.snapshot()["stages"])
+        self._snapshot = snapshot
+        self._render()
+
+    def update_alerts(self, display_dict, source=None):
         """
         Display potential alert triggers or recoveries
-        :param display_dict: (dict) dict returned by datastruct.compute_alert()
+        :param display_dict: (dict) dict returned by datastruct.compute_alert() or in datastruct.compute_alerts(), or
+                             by rules.RuleEngine.tick() whose "rule" and "metric" keys are shown
+        :param source: (string) log file or rule the alert is about, None for the merged traffic
         :return: None
         """
-        self._go_to_first_blank(self.box2)
+        event_time = time.strftime("%H:%M:%S", time.localtime(display_dict.get("time")))  # event-time alerts carry
+        metric = display_dict.get("metric", "Hits/s")                                      # their second, else now
+        if "rule" in display_dict:
+            suffix = " ({})".format(display_dict["rule"])
+        else:
+            suffix = "" if source is None else " ({})".format(os.path.basename(source))
         if display_dict["status_code"] == 1:
-            y = self._go_to_first_blank(self.box2)
-            self.box2.addstr(y, 4, self.HIGH_TRAFFIC_TEMPLATE.format(display_dict["debit"]))
-            self.box2.addstr(y + 1, 4, "Triggered at: {time}".format(time=time.strftime("%H:%M:%S", time.localtime())))
+            self._alerts.append([self.HIGH_TRAFFIC_TEMPLATE.format(metric, display_dict["debit"]),
+                                 self.TRIGGERED.format(event_time) + suffix, "", source])
         elif display_dict["status_code"] == 0:
-            y = self._go_to_first_blank(self.box2)
-            self.box2.addstr(y - 1, 4, self.RECOVER.format(time.strftime("%H:%M:%S", time.localtime()),
-                                                           display_dict["debit"]))
-
-    def _go_to_first_blank(self, box):
-        """
-        Returns first line blank line where we can write without overwriting anything. If there are not enough blank
-        lines, scrolls up the window, thus removing oldest entries
-        :param box: (curses.window) window object where we want to write
-        :return: (int) line number of first writable line
-        """
-        for y in range(4, 41):
-            self.box2.move(y, 4)
-            if chr(self.box2.inch() & 0xFF) == ' ': # binary and because char is in bottom 8 bits.
-                self.box2.move(y + 1, 4)
-                if chr(self.box2.inch() & 0xFF) == ' ': # look for 2 blank lines in a raw
-                    y, x = self.box2.getyx()   # store position, we can add new alert below
-                    try:
-                        if chr(self.box2.inch(y + 1, x) & 0xFF) == ' ':
-                            return y
-                    except curses.error: # this is the case where we had 2 blank lines but these were the last 2 lines
-                        pass # of the screen. We can't /n + write two lines so we need to proceed to screen scrolling
-        # screen is filled with alerts
-        self.box2.scrollok(True)
-        self.box2.move(4, 4)
-        self.box2.setscrreg(4, 41)
-        self.box2.scroll(4)
-        self.box2.box() # need to redraw borders
-        return self._go_to_first_blank(self.box2)
+            recovered = self.RECOVER.format(event_time, metric.lower(), display_dict["debit"]) + suffix
+            for alert in reversed(self._alerts):  # recovery of the last alert raised for the same traffic
+                if alert[3] == source and not alert[2]:
+                    alert[2] = recovered
+                    break
+            else:  # its trigger was scrolled out of the history, or raised before a restart from a checkpoint
+                self._alerts.append([self.EARLIER_ALERT + suffix, "", recovered, source])
+        else:
+            return
+        self._render()
@@ -0,0 +1,255 @@
+"""
+Endpoint module
+Optional local HTTP endpoint, on a TCP port or a Unix socket, serving the statistics of the last period, the current
+debit, alert states and alert history to dashboards and scrapers:
+    /  or /snapshot     JSON
+    /metrics            Prometheus text format
+    /history            JSON, counts of the recent requests kept with -m, e.g. /history?group_by=section&last=300
+Once per period the ingest thread renders both formats into an immutable snapshot and swaps a single reference to it:
+snapshot requests, however many, only read that reference. They never take a lock the ingest thread waits on and
+never trigger any computation. History queries run on the thread of their request, one at a time, against a copy of
+the requests kept that the ingest thread publishes with each snapshot: they never stop ingestion, only slow it down
+while they run.
+"""
+import http.server
+import json
+import os
+import socketserver
+import threading
+import time
+import urllib.parse
+from collections import deque
+from collections import namedtuple
+import columnar as cl
+
+ALERT_HISTORY = 1000  # alerts kept in the snapshot, older ones are forgotten
+TOP = 10  # default number of groups returned by a history query
+PREFIX = "http_monitor_"
+JSON_TYPE = "application/json"
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Published = namedtuple("Published", ["json", "prometheus"])  # bodies of the responses, rendered once per period
+
+
+def _escape(value):
+    """
+    :param value: (string) Prometheus label value
+    :return: (string) value with backslashes, double quotes and newlines escaped
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(record):
+    """
+    Renders a snapshot in the Prometheus text exposition format
+    :param record: (dict) snapshot as published in JSON, cf SnapshotPublisher.publish
+    :return: (string) metrics, one family after the other
+    """
+    lines = []
+
+    def family(name, kind, description, samples):
+        """
+        :param samples: (list) of tuples (labels dict, value), samples whose value is None are skipped
+        """
+        lines.append("# HELP {}{} {}".format(PREFIX, name, description))
+        lines.append("# TYPE {}{} {}".format(PREFIX, name, kind))
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_text = ",".join('{}="{}"'.format(label, _escape(text)) for label, text in sorted(labels.items()))
+            lines.append("{}{}{} {}".format(PREFIX, name, "{" + label_text + "}" if label_text else "", value))
+
+    family("period", "counter", "Number of monitoring periods", [({}, record["counter"])])
+    family("hits", "gauge", "Hits during the last period", [({}, record["last_hits"])])
+    family("traffic_bytes", "gauge", "Bytes sent during the last period", [({}, record["last_traffic"])])
+    family("debit", "gauge", "Mean hits per second over the alert period", [({}, record["debit"])])
+    family("malformed_lines_total", "counter", "Lines that were not W3C formatted",
+           [({}, record["malformed_lines"])])
+    family("section_hits", "gauge", "Hits of the top sections during the last period",
+           [({"section": section}, hits) for section, hits in record["top_sections"]])
+    family("user_hits", "gauge", "Hits of the top users during the last period",
+           [({"user": user}, hits) for user, hits in record["top_users"]])
+    family("section_errors", "gauge", "4xx and 5xx responses of the top sections during the last period",
+           [({"section": section}, errors) for section, errors in record["errors"]])
+    family("response_size_bytes", "gauge", "Percentiles of response sizes during the last period",
+           [({"quantile": "0.{}".format(key[1:])}, value) for key, value in sorted(record["size_percentiles"].items())])
+    if record.get("source_hits"):
+        family("source_hits", "gauge", "Hits per log file during the last period",
+               [({"source": path}, hits) for path, hits in record["source_hits"].items()])
+    family("on_alert", "gauge", "1 if the traffic is on alert",
+           [({"source": source}, int(on_alert)) for source, on_alert in record["alert_states"].items()])
+    family("alerts_total", "counter", "Alert triggers and recoveries since start", [({}, record["alerts_total"])])
+    metrics = record.get("metrics")
+    if metrics is not None:
+        family("ingested_lines_total", "counter", "Lines read", [({}, metrics["lines"])])
+        family("ingested_bytes_total", "counter", "Bytes read", [({}, metrics["bytes"])])
+        family("ingest_lines_per_second", "gauge", "Lines read per second during the last period",
+               [({}, metrics["lines_per_second"])])
+        family("bytes_behind", "gauge", "Bytes written to the log files and not read yet",
+               [({}, metrics["bytes_behind"])])
+        family("stage_busy_ratio", "gauge", "Share of the last period spent in each stage",
+               [({"stage": stage}, timer["busy"]) for stage, timer in sorted(metrics["stages"].items())])
+    return "\n".join(lines) + "\n"
+
+
+def history_query(history, parameters):
+    """
+    Counts the recent requests kept in the history of the merged traffic
+    :param history: (columnar.RequestStore) requests kept, None if there is no history
+    :param parameters: (dict) {name: value} from the query string: group_by (one of columnar.GROUPS), last (number of
+                       seconds up to the most recent request stored) or start and end (seconds since epoch), errors
+                       (1 for 4xx and 5xx only), top (number of groups returned) and filters on columnar.GROUPS
+    :return: (dict) dict.keys() = ["start", "end", "hits", "traffic"] + ["counts"] with group_by: list of [value, hits]
+             of the top groups
+    """
+    if history is None:
+        raise LookupError("no request history, start the monitor with -m")
+    unknown = parameters.keys() - {"group_by", "last", "start", "end", "errors", "top"} - set(cl.GROUPS)
+    if unknown:
+        raise ValueError("unknown parameters {}".format(sorted(unknown)))
+    start = int(parameters["start"]) if "start" in parameters else None
+    end = int(parameters["end"]) if "end" in parameters else None
+    time_range = history.time_range()
+    if "last" in parameters and time_range is not None:
+        end = time_range[1] + 1
+        start = end - int(parameters["last"])
+    errors = parameters.get("errors") in ("1", "true")
+    filters = {field: parameters[field] for field in cl.GROUPS if field in parameters}
+    hits, traffic, counts = history.query(parameters.get("group_by"), start, end, errors, **filters)
+    record = {"start": start, "end": end, "hits": hits, "traffic": traffic}
+    if "group_by" in parameters:
+        record["counts"] = counts.most_common(int(parameters.get("top", TOP)))
+    return record
+
+
+class SnapshotPublisher:
+    """renders one immutable snapshot per period, served as is to every request"""
+
+    def __init__(self, alert_history=ALERT_HISTORY):
+        self._alerts = deque(maxlen=alert_history)  # only touched by the ingest thread
+        self._alerts_total = 0
+        self.published = None  # Published, None until the 1st period ends
+        self.history = None  # copy of the requests kept at the end of the last period, None without history
+        self.history_lock = threading.Lock()  # history queries run one at a time
+
+    def publish(self, snapshot, alert_states, history=None):
+        """
+        Renders and publishes the snapshot of a period. Called by the ingest thread only
+        :param snapshot: (dict) MultiLog.snapshot() with "alerts" (and "metrics") added by the ingest worker
+        :param alert_states: (dict) {path or None for the merged traffic: on_alert}, cf MultiLog.alert_states
+        :param history: (columnar.RequestStore) copy of the requests kept, not filled anymore - optional
+        :return: None
+        """
+        for source, alert_info in snapshot["alerts"]:
+            alert = dict(alert_info)
+            alert["source"] = source
+            self._alerts.append(alert)
+        self._alerts_total += len(snapshot["alerts"])
+        record = {key: value for key, value in snapshot.items() if key != "alerts"}
+        record.update(time=time.time(), alerts_total=self._alerts_total, alert_history=list(self._alerts),
+                      alert_states={"merged" if source is None else source: on_alert
+                                    for source, on_alert in alert_states.items()})
+        self.history = history
+        # a single reference swap: requests read either the previous snapshot or this one, never a mix
+        self.published = Published(json.dumps(record).encode(), prometheus_text(record).encode())
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    ROUTES = {"/": ("json", JSON_TYPE), "/snapshot": ("json", JSON_TYPE), "/metrics": ("prometheus", PROMETHEUS_TYPE)}
+
+    def do_GET(self):
+        path, _, query_string = self.path.partition("?")
+        if path == "/history":
+            self._history(query_string)
+            return
+        route = self.ROUTES.get(path)
+        published = self.server.publisher.published
+        if route is None:
+            self.send_error(404)
+            return
+        if published is None:
+            self.send_error(503, "first monitoring period not over yet")
+            return
+        self._send(getattr(published, route[0]), route[1])
+
+    def _history(self, query_string):
+        """
+        Answers a history query, cf history_query
+        :param query_string: (string) parameters of the query
+        :return: None
+        """
+        publisher = self.server.publisher
+        if publisher.published is None:
+            self.send_error(503, "first monitoring period not over yet")
+            return
+        parameters = dict(urllib.parse.parse_qsl(query_string))
+        try:
+            with publisher.history_lock:  # concurrent queries would only share the interpreter with ingestion
+                record = history_query(publisher.history, parameters)
+        except LookupError as error:
+            self.send_error(404, str(error))
+            return
+        except ValueError as error:
+            self.send_error(400, str(error))
+            return
+        self._send(json.dumps(record).encode(), JSON_TYPE)
+
+    def _send(self, body, content_type):
+        """
+        :param body: (bytes) response body
+        :param content_type: (string) its content type
+        :return: None
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # requests are not logged: the terminal belongs to curses
+        pass
+
+
+class _TCPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def get_request(self):
+            request, _ = super().get_request()
+            return request, ("unix", 0)  # BaseHTTPRequestHandler expects a (host, port) client address
+
+
+def start_server(address, publisher):
+    """
+    Serves the snapshots of a publisher on a background thread
+    :param address: (string) "host:port", ":port" for localhost, or "unix:path" for a Unix socket
+    :param publisher: (SnapshotPublisher) publisher whose snapshots are served
+    :return: (socketserver.BaseServer) running server, cf stop_server
+    """
+    if address.startswith("unix:"):
+        path = address[len("unix:"):]
+        if os.path.exists(path):  # left by a previous run
+            os.remove(path)
+        server = _UnixServer(path, _Handler)
+    else:
+        host, _, port = address.rpartition(":")
+        server = _TCPServer((host or "127.0.0.1", int(port)), _Handler)
+    server.publisher = publisher
+    threading.Thread(target=server.serve_forever, name="endpoint", daemon=True).start()
+    return server
+
+
+def stop_server(server):
+    """
+    Stops a server started with start_server and removes its Unix socket, if any
+    :param server: (socketserver.BaseServer)
+    :return: None
+    """
+    server.shutdown()
+    server.server_close()
+    if isinstance(server.server_address, str) and os.path.exists(server.server_address):
+        os.remove(server.server_address)
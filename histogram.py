@@ -0,0 +1,206 @@
+"""
+Histogram module
+Log-linear (HDR-style) histograms: values below 2 ** SUB_BITS have their own bucket, above that every power of two is
+split into 2 ** (SUB_BITS - 1) buckets. A value is recorded in O(1), memory only depends on the largest value
+(about 700 buckets for 2 ** 40) and a percentile is reported with a relative error below 2 ** (1 - SUB_BITS), i.e. 6%.
+Histograms are merged by adding their buckets.
+"""
+from collections import Counter
+
+SUB_BITS = 5
+TABLE_SIZE = 1 << 16
+PERCENTILES = (50, 95, 99)
+MAX_KEYS = 1000  # KeyedHistograms: keys beyond this number share the OTHER histogram
+OTHER = "(other)"
+
+
+def bucket_index(value):
+    """
+    :param value: (int) non-negative value
+    :return: (int) index of the bucket holding value
+    """
+    shift = max(0, value.bit_length() - SUB_BITS)
+    return (shift << (SUB_BITS - 1)) + (value >> shift)
+
+
+def bucket_bounds(index):
+    """
+    :param index: (int) bucket index
+    :return: (int, int) lowest and highest values held by the bucket
+    """
+    shift = max(0, (index >> (SUB_BITS - 1)) - 1)
+    low = (index - (shift << (SUB_BITS - 1))) << shift
+    return low, low + (1 << shift) - 1
+
+
+INDEX_TABLE = [bucket_index(value) for value in range(TABLE_SIZE)]  # most response sizes are looked up directly
+
+
+def bucket_indexes(values):
+    """
+    :param values: (list) of non-negative int
+    :return: (list) of bucket indexes, one per value
+    """
+    table = INDEX_TABLE
+    return [table[value] if value < TABLE_SIZE else bucket_index(value) for value in values]
+
+
+class LogHistogram:
+    """bounded-memory histogram of non-negative int values, e.g. response sizes"""
+
+    def __init__(self):
+        self._buckets = []  # number of values per bucket index, grown up to the largest index seen
+        self.count = 0
+        self.max = 0  # largest value recorded, or highest value of its bucket if recorded by index without maximum
+
+    def _grow(self, index):
+        if index >= len(self._buckets):
+            self._buckets.extend([0] * (index + 1 - len(self._buckets)))
+
+    def add(self, value, count=1):
+        """
+        Records a value
+        :param value: (int) non-negative value
+        :param count: (int) number of times it is recorded
+        :return: None
+        """
+        index = INDEX_TABLE[value] if value < TABLE_SIZE else bucket_index(value)
+        self._grow(index)
+        self._buckets[index] += count
+        self.count += count
+        self.max = max(self.max, value)
+
+    def add_index(self, index, count=1, maximum=None):
+        """
+        Records a value given by its bucket index, cf bucket_indexes
+        :param index: (int) bucket index
+        :param count: (int) number of values recorded
+        :param maximum: (int) largest value recorded along with this one, if known: percentiles are capped by it
+        :return: None
+        """
+        self._grow(index)
+        self._buckets[index] += count
+        self.count += count
+        if maximum is None:  # exact value unknown: highest value of the bucket
+            maximum = bucket_bounds(index)[1]
+        self.max = max(self.max, maximum)
+
+    def add_indexes(self, indexes, maximum=None):
+        """
+        Records many values given by their bucket indexes
+        :param indexes: (iterable) of bucket indexes
+        :param maximum: (int) largest value recorded, if known: percentiles are capped by it
+        :return: None
+        """
+        top = -1
+        for index, count in Counter(indexes).items():  # values are aggregated in C first
+            self._grow(index)
+            self._buckets[index] += count
+            self.count += count
+            top = max(top, index)
+        if top >= 0:
+            self.max = max(self.max, bucket_bounds(top)[1] if maximum is None else maximum)
+
+    def merge(self, other):
+        """
+        Adds the values of another histogram to this one
+        :param other: (LogHistogram)
+        :return: None
+        """
+        self._grow(len(other._buckets) - 1)
+        for index, count in enumerate(other._buckets):
+            self._buckets[index] += count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """
+        :param percent: (float) between 0 and 100
+        :return: (int) highest value of the bucket where the percentile lies, capped by the maximum recorded - None if
+                 the histogram is empty
+        """
+        if self.count == 0:
+            return None
+        rank = max(1, -(-self.count * percent // 100))  # ceil: number of values at or below the percentile
+        seen = 0
+        for index, count in enumerate(self._buckets):
+            seen += count
+            if seen >= rank:
+                return min(bucket_bounds(index)[1], self.max)
+
+    def percentiles(self, percents=PERCENTILES):
+        """
+        :param percents: (tuple) of percentiles wanted
+        :return: (dict) {"p50": value, ...}
+        """
+        return {"p{}".format(percent): self.percentile(percent) for percent in percents}
+
+    def clear(self):
+        """
+        Forgets every value
+        :return: None
+        """
+        self._buckets = []
+        self.count = 0
+        self.max = 0
+
+
+class KeyedHistograms:
+    """one LogHistogram per key (e.g. per section), for at most max_keys keys"""
+
+    def __init__(self, max_keys=MAX_KEYS):
+        self.max_keys = max_keys
+        self._histograms = {}  # {key: LogHistogram}
+
+    def _histogram(self, key):
+        """
+        :return: (LogHistogram) histogram of the key, the OTHER histogram if there are too many keys already
+        """
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            if len(self._histograms) >= self.max_keys:
+                key = OTHER
+                histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LogHistogram()
+        return histogram
+
+    def add_indexes(self, keys, indexes, values=None):
+        """
+        Records many values given by their key and bucket index
+        :param keys: (list) of keys
+        :param indexes: (list) of bucket indexes, cf bucket_indexes, one per key
+        :param values: (list) of the values themselves, one per key, so that the maximum of each key is exact - optional
+        :return: None
+        """
+        maxima = {}  # {key: largest value}
+        if values is not None:
+            for key, value in zip(keys, values):
+                if value > maxima.get(key, -1):
+                    maxima[key] = value
+        for (key, index), count in Counter(zip(keys, indexes)).items():  # pairs are aggregated in C first
+            self._histogram(key).add_index(index, count, maxima.get(key))
+
+    def merge(self, other):
+        """
+        Adds the values of other keyed histograms to these
+        :param other: (KeyedHistograms)
+        :return: None
+        """
+        for key, histogram in other._histograms.items():
+            self._histogram(key).merge(histogram)
+
+    def percentiles(self, key, percents=PERCENTILES):
+        """
+        :param key: key whose percentiles are wanted
+        :param percents: (tuple) of percentiles wanted
+        :return: (dict) {"p50": value, ...}, values being None if the key has no value
+        """
+        return self._histograms.get(key, LogHistogram()).percentiles(percents)
+
+    def clear(self):
+        """
+        Forgets every key
+        :return: None
+        """
+        self._histograms.clear()
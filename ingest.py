@@ -0,0 +1,131 @@
+"""
+Ingest module
+Runs tailing, parsing and aggregation on a background thread so that counting keeps up whatever the speed of the
+curses display. Once per period, the worker hands a snapshot of the statistics and the alerts raised to the display
+through a bounded queue: if the display falls behind, the oldest statistics are dropped (and counted) but their
+alerts are carried over to the oldest snapshot still queued so that none is lost. The worker also saves a checkpoint
+at the end of every period and when it stops, if asked to, and hands each snapshot to a publisher serving it to local
+scrapers, cf endpoint module.
+"""
+import selectors
+import threading
+import time
+from collections import deque
+import checkpoint as cp
+import watcher as wt
+
+
+class IngestWorker(threading.Thread):
+    """background thread filling a MultiLog and publishing one snapshot per period"""
+    MAX_WAIT = 1.0  # seconds: the worker checks at least this often whether it has been stopped
+
+    def __init__(self, logs, stats_period, alert_treshold, merged_treshold, queue_size=8, checkpoint_path=None,
+                 publisher=None):
+        """
+        :param logs: (MultiLog) log files to fill, only accessed by the worker once started
+        :param stats_period: (int) monitoring period length in seconds
+        :param alert_treshold: (int) in hits/second, for each log file
+        :param merged_treshold: (int) in hits/second, for the merged traffic
+        :param queue_size: (int) number of snapshots waiting for the display before the oldest is dropped
+        :param checkpoint_path: (string) file where the state of logs is saved, cf checkpoint module - optional
+        :param publisher: (endpoint.SnapshotPublisher) publisher of the snapshots to local scrapers - optional
+        """
+        super().__init__(name="ingest", daemon=True)
+        self.logs = logs
+        self.stats_period = stats_period
+        self.alert_treshold = alert_treshold
+        self.merged_treshold = merged_treshold
+        self.queue_size = queue_size
+        self._snapshots = deque()  # snapshots not taken by the display yet, oldest first
+        self._snapshots_lock = threading.Lock()  # only held to add or take snapshots, never while reading lines
+        self.dropped_snapshots = 0  # number of snapshots the display didn't take in time
+        self.error = None  # exception that stopped the worker, if any
+        self.checkpoint_path = checkpoint_path
+        self.publisher = publisher
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """
+        Asks the worker to stop, it does within MAX_WAIT seconds
+        :return: None
+        """
+        self._stop_event.set()
+
+    def run(self):
+        file_watcher = wt.FileWatcher(self.logs.paths)
+        selector = selectors.DefaultSelector()
+        timeout = self.MAX_WAIT if file_watcher.poll_interval is None else file_watcher.poll_interval
+        if file_watcher.fileno() is not None:
+            selector.register(file_watcher, selectors.EVENT_READ)
+        try:
+            self.logs.fill()  # 1st fill goes to the end of the log files
+            self._end_period()  # 1st period: the display shows a waiting message
+            period_end = time.monotonic() + self.stats_period
+            while not self._stop_event.is_set():
+                selector.select(max(0, min(period_end - time.monotonic(), timeout)))  # until a log file grows
+                if file_watcher.changed():
+                    self.logs.fill()  # new lines are aggregated as soon as they are written
+                if time.monotonic() >= period_end:
+                    period_end += self.stats_period  # periods are scheduled from start time so they don't drift
+                    self._end_period()
+            self._save_checkpoint()  # lines read since the end of the period are not read again on restart
+        except Exception as error:
+            self.error = error
+            raise
+        finally:
+            selector.close()
+            file_watcher.close()
+
+    def _end_period(self):
+        """
+        Publishes last period statistics, the alerts raised and the metrics of the worker, then starts a new period
+        :return: None
+        """
+        metrics = self.logs.metrics
+        with metrics.stages["stats"]:
+            snapshot = self.logs.snapshot()
+            self.logs.clear_last()
+        with metrics.stages["alert"]:
+            snapshot["alerts"] = self.logs.compute_alerts(self.alert_treshold, self.merged_treshold)
+        self._save_checkpoint()
+        metrics.bytes_behind = self.logs.bytes_behind()
+        metrics.dropped_snapshots = self.dropped_snapshots
+        snapshot["metrics"] = metrics.snapshot()
+        if self.publisher is not None:  # before the display can add the alerts of dropped snapshots
+            history = self.logs.merged.history  # copied: the endpoint queries it while the worker fills the original
+            self.publisher.publish(snapshot, self.logs.alert_states(), history.copy() if history is not None else None)
+        self._publish(snapshot)
+
+    def _save_checkpoint(self):
+        """
+        Saves the state of the log files, if a checkpoint path was given
+        :return: None
+        """
+        if self.checkpoint_path is not None:
+            cp.save(self.checkpoint_path, self.logs.get_state())
+
+    def _publish(self, snapshot):
+        """
+        Queues a snapshot without ever waiting for the display: when the queue is full the oldest snapshot is dropped
+        and its alerts are prepended to those of the oldest snapshot still queued, so that alerts stay in time order
+        :param snapshot: (dict) snapshot to publish
+        :return: None
+        """
+        with self._snapshots_lock:
+            if len(self._snapshots) >= self.queue_size:
+                oldest = self._snapshots.popleft()
+                next_oldest = self._snapshots[0] if self._snapshots else snapshot
+                next_oldest["alerts"] = oldest["alerts"] + next_oldest["alerts"]
+                self.dropped_snapshots += 1
+            snapshot["dropped_snapshots"] = self.dropped_snapshots
+            self._snapshots.append(snapshot)
+
+    def get_snapshots(self):
+        """
+        Returns every published snapshot not taken yet, without blocking. Called by the display thread
+        :return: (list) of snapshots, oldest first
+        """
+        with self._snapshots_lock:
+            snapshots = list(self._snapshots)
+            self._snapshots.clear()
+        return snapshots
@@ -3,12 +3,17 @@ Generate an actively written-to logfile. Loglines are
 - par   tially randomized so that interesting statistics can be infered.
 - W3C formatted: 127.0.0.1 user-identifier frank [10/Oct/2000:13:55:36 -0700] "GET /test/image.jpg HTTP/1.1" 200 2326
 - generated so that line-throughput varies.
+With --rate, it runs as a load generator instead: lines are written in buffered batches at a target rate following a
+traffic profile, and the rate actually achieved is reported.
 """
+import argparse
+import itertools
+import os
 import random
 import time
 import datetime
 
-W3C_TEMPLATE = "192.168.0.{ip_last} - {user_id} [{datetime} -0700] \"{method} /{section}/{page} HTTP/1.1\" {status} " \
+W3C_TEMPLATE = "192.168.0.{ip_last} - {user_id} [{datetime}] \"{method} /{section}/{page} HTTP/1.1\" {status} " \
                "{size}"
 USER_ID = {"192.168.0.1":"Corentin",
            "192.168.0.2": "Remi",
@@ -23,6 +28,12 @@ SITE_FRUIT_PAGES = ["orange.jpg", "lemon.jpg", "kiwi.jpg", "lime.jpg", "pineappl
 SITE_VEGETABLE_PAGES = ["artichoke.jpg", "asparagus.jpg", "corn.jpg", "pea.jpg", "potato.jpg"]
 SITE_OTHERS_PAGES = ["rice.jpg", "pasta.jpg", "mushroom.jpg", "42.jpg"]
 PATH = "logs2.txt"
+TIMESTAMP_FORMAT = "%d/%b/%Y:%H:%M:%S %z"
+PROFILES = ["steady", "ramp", "burst", "rotation"]
+LOAD_TICK = 0.1  # seconds between two batches written in load mode
+LOAD_POOL_SIZE = 10000  # distinct lines cycled through in load mode
+BURST_PERIOD = 60  # burst profile: full rate during BURST_LENGTH seconds every BURST_PERIOD seconds, 10% otherwise
+BURST_LENGTH = 10
 
 
 def generate_logline():
@@ -41,7 +52,7 @@ def generate_logline():
 
     line = W3C_TEMPLATE.format(ip_last=ip_last,
                                user_id=USER_ID["192.168.0." + str(ip_last)],
-                               datetime=time.strftime("%d/%b/%Y:%H:%M:%S"),
+                               datetime=datetime.datetime.now().astimezone().strftime(TIMESTAMP_FORMAT),
                                method=random.choice(HTTP_METHOD),
                                section=site_section,
                                page=site_page,
@@ -50,9 +61,105 @@ def generate_logline():
     return line
 
 
-def main():
+def generate_loglines(nb_lines, seed=0, nb_users=len(USER_ID), nb_sections=len(SITE_SECTIONS), rate=100, start=0):
+    """
+    Generates W3C formatted log lines at full speed, without sleeping: lines are timestamped as if rate lines were
+    written every second. Same seed and arguments give the same lines
+    :param nb_lines: (int) number of lines
+    :param seed: (int) random seed
+    :param nb_users: (int) number of distinct users, the first ones being those of USER_ID
+    :param nb_sections: (int) number of distinct sections, the first ones being SITE_SECTIONS
+    :param rate: (int) lines per second of log time
+    :param start: (int) timestamp of the first line, in seconds since epoch
+    :return: (generator) log lines (strings, without newline)
+    """
+    rng = random.Random(seed)
+    users = list(USER_ID.values()) + ["user{}".format(index) for index in range(len(USER_ID), nb_users)]
+    sections = SITE_SECTIONS + ["section{}".format(index) for index in range(len(SITE_SECTIONS), nb_sections)]
+    pages = {"fruits": SITE_FRUIT_PAGES, "vegetables": SITE_VEGETABLE_PAGES}
+    all_pages = SITE_FRUIT_PAGES + SITE_VEGETABLE_PAGES + SITE_OTHERS_PAGES
+    timestamp = None
+    for index in range(nb_lines):
+        if index % rate == 0:  # formatting a date is costly, it's done once per second of log time
+            timestamp = time.strftime(TIMESTAMP_FORMAT.replace("%z", "+0000"), time.gmtime(start + index // rate))
+        user = rng.randrange(nb_users)
+        section = sections[rng.randrange(nb_sections)]
+        yield W3C_TEMPLATE.format(ip_last=user + 1,
+                                  user_id=users[user],
+                                  datetime=timestamp,
+                                  method=rng.choice(HTTP_METHOD),
+                                  section=section,
+                                  page=rng.choice(pages.get(section, all_pages)),
+                                  status=rng.choice(HTTP_STATUS),
+                                  size=rng.randrange(10001))
+
+
+def profile_rate(profile, rate, elapsed, duration):
+    """
+    Returns the target rate of a traffic profile at a given time
+    :param profile: (string) one of PROFILES: steady and rotation keep rate, ramp goes linearly from 0 to rate,
+                    burst writes at rate BURST_LENGTH seconds every BURST_PERIOD seconds and at rate / 10 otherwise
+    :param rate: (float) peak rate in lines/second
+    :param elapsed: (float) seconds since start
+    :param duration: (float) total duration in seconds
+    :return: (float) target rate in lines/second
+    """
+    if profile == "ramp":
+        return rate * min(1.0, elapsed / duration)
+    if profile == "burst":
+        return rate if elapsed % BURST_PERIOD < BURST_LENGTH else rate / 10.0
+    return rate
+
+
+def load(path, rate, duration, profile="steady", seed=0):
+    """
+    Writes log lines at a target rate with buffered batches: one write and one flush every LOAD_TICK seconds, lines
+    being cycled from a pool generated once. Rotation profile renames the file to path.1 half-way through and goes on
+    in a new file
+    :param path: (string) log file path
+    :param rate: (float) peak rate in lines/second
+    :param duration: (float) duration in seconds
+    :param profile: (string) one of PROFILES
+    :param seed: (int) random seed of the line pool
+    :return: (int, float) number of lines written, duration in seconds
+    """
+    marker = "01/Jan/1970:00:00:00 +0000"  # timestamp of the pool lines, replaced by the time of each batch
+    pool = [line + "\n" for line in generate_loglines(LOAD_POOL_SIZE, seed, rate=LOAD_POOL_SIZE)]
+    lines = itertools.cycle(pool)
+    written = 0
+    due = 0.0  # lines that should have been written so far according to the profile
+    rotated = profile != "rotation"
+    log_file = open(path, 'a', buffering=1 << 20)
+    start = last = time.monotonic()
+    try:
+        while last - start < duration:
+            now = time.monotonic()
+            due += profile_rate(profile, rate, now - start, duration) * (now - last)
+            last = now
+            if not rotated and now - start >= duration / 2:
+                log_file.close()
+                os.replace(path, path + ".1")
+                log_file = open(path, 'a', buffering=1 << 20)
+                rotated = True
+            batch = int(due) - written
+            if batch > 0:
+                timestamp = datetime.datetime.now().astimezone().strftime(TIMESTAMP_FORMAT)
+                log_file.write("".join(itertools.islice(lines, batch)).replace(marker, timestamp))
+                log_file.flush()  # once per batch: the monitor sees lines at most LOAD_TICK seconds late
+                written += batch
+            time.sleep(max(0.0, LOAD_TICK - (time.monotonic() - now)))
+    finally:
+        log_file.close()
+    return written, time.monotonic() - start
+
+
+def main(args):
+    if args.rate is not None:
+        written, elapsed = load(args.path, args.rate, args.duration, args.profile, args.seed)
+        print("{} lines written in {:.1f}s: {:,.0f} lines/s achieved".format(written, elapsed, written / elapsed))
+        return 0
     go_on = True
-    with open(str(PATH), 'a') as file:
+    with open(str(args.path), 'a') as file:
         while go_on:
             try:
                 high = (random.randint(1, 1500) == 1)            # i should have a traffic peak every 1500 lines ~ 2 min
@@ -82,4 +189,12 @@ def main():
     return 0
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='W3C log creator')
+    parser.add_argument('-o', help='log file path - default to logs2.txt', default=PATH, dest="path")
+    parser.add_argument('-r', help='load mode: peak rate in lines/second (int)', type=int, default=None, dest="rate")
+    parser.add_argument('-d', help='load mode: duration in seconds (int) - default to 60s', type=int, default=60,
+                        dest="duration")
+    parser.add_argument('-p', help='load mode: traffic profile - default to steady', choices=PROFILES,
+                        default="steady", dest="profile")
+    parser.add_argument('--seed', help='load mode: random seed (int)', type=int, default=0)
+    main(parser.parse_args())
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Metrics module
+Self-instrumentation of the monitor: counters of what has been ingested and timers around each stage of the work,
+cheap enough to be always on (a couple of perf_counter calls per chunk of lines, not per line). Once per period the
+counters are turned into rates and the timers into the share of the period each stage kept its thread busy, which
+tells which stage is the bottleneck when the monitor falls behind.
+"""
+import json
+import time
+
+STAGES = ("tail", "parse", "aggregate", "stats", "alert")  # ingest thread stages, the display adds "render"
+
+
+class StageTimer:
+    """context manager adding up the time spent in a stage, e.g. with metrics.stages["parse"]: ..."""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0  # longest call since last Metrics.snapshot
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self._start
+        self.calls += 1
+        self.seconds += elapsed
+        if elapsed > self.max_seconds:
+            self.max_seconds = elapsed
+        return False
+
+
+class Metrics:
+    """counters and stage timers of one thread, cf module docstring"""
+
+    def __init__(self, stages=STAGES):
+        self.stages = {stage: StageTimer() for stage in stages}
+        self.lines = 0  # lines read, malformed ones included
+        self.bytes = 0  # bytes read
+        self.malformed_lines = 0
+        self.bytes_behind = 0  # bytes written to the log files but not read yet, measured at the end of each period
+        self.dropped_snapshots = 0
+        self._started = time.monotonic()
+        self._previous = (self._started, 0, 0, {stage: (0, 0.0) for stage in stages})  # at last snapshot
+
+    def count_batch(self, nb_bytes, batch):
+        """
+        Counts a chunk of lines read
+        :param nb_bytes: (int) size of the chunk
+        :param batch: (regex_parser.ParsedBatch) its parsed lines
+        :return: None
+        """
+        self.bytes += nb_bytes
+        self.lines += len(batch.sizes) + batch.malformed
+        self.malformed_lines += batch.malformed
+
+    def snapshot(self):
+        """
+        Returns the metrics since the previous call and starts a new measurement period
+        :return: (dict) dict.keys() = ["uptime", "lines", "bytes", "malformed_lines", "lines_per_second",
+                 "bytes_per_second", "bytes_behind", "dropped_snapshots", "stages"]. Counters are totals since start,
+                 rates and stages cover the period since the previous call. stages is {stage: {"calls", "seconds",
+                 "busy", "max_ms"}}, busy being the share of the period spent in the stage
+        """
+        now = time.monotonic()
+        previous_time, previous_lines, previous_bytes, previous_stages = self._previous
+        elapsed = max(now - previous_time, 1e-9)
+        stages = {}
+        for name, timer in self.stages.items():
+            calls, seconds = previous_stages[name]
+            stages[name] = {"calls": timer.calls - calls, "seconds": round(timer.seconds - seconds, 6),
+                            "busy": round((timer.seconds - seconds) / elapsed, 4),
+                            "max_ms": round(timer.max_seconds * 1000, 3)}
+            timer.max_seconds = 0.0
+        self._previous = (now, self.lines, self.bytes,
+                          {name: (timer.calls, timer.seconds) for name, timer in self.stages.items()})
+        return {"uptime": round(now - self._started, 3), "lines": self.lines, "bytes": self.bytes,
+                "malformed_lines": self.malformed_lines,
+                "lines_per_second": round((self.lines - previous_lines) / elapsed, 1),
+                "bytes_per_second": round((self.bytes - previous_bytes) / elapsed, 1),
+                "bytes_behind": self.bytes_behind, "dropped_snapshots": self.dropped_snapshots, "stages": stages}
+
+
+def dump(metrics_snapshot, path):
+    """
+    Appends a metrics snapshot to a file as a JSON line
+    :param metrics_snapshot: (dict) returned by Metrics.snapshot
+    :param path: (string) file path
+    :return: None
+    """
+    record = {"time": int(time.time())}
+    record.update(metrics_snapshot)
+    with open(path, 'a') as output:
+        output.write(json.dumps(record, sort_keys=True) + "\n")
@@ -1,34 +1,115 @@
-import datastruct as dt
+import checkpoint as cp
+import multilog as ml
 import display as dp
+import endpoint as ep
+import ingest as ig
+import replay as rp
+import rules as rl
+import segments as sg
 import curses
 import argparse
+import selectors
+import sys
 
 
 def main(myscreen, args):
     stats_period = args.p_stats
     alert_period = args.p_alert
     alert_treshold = args.t_alert
-    log_file = "logs2.txt"
-    on_alert = False
-    loop = True
-    datastruct = dt.Datastruct(alert_period, stats_period)
-    display = dp.Display(myscreen)
+    log_files = ml.expand_paths(args.log_files)
+    merged_treshold = args.g_alert if args.g_alert is not None else alert_treshold * len(log_files)
+    logs = ml.MultiLog(log_files, alert_period, stats_period, rules=args.rules, event_time=True, lateness=args.lateness,
+                       top_k=args.top_k, workers=args.workers, history=args.history)
+    if args.checkpoint is not None:
+        state = cp.load(args.checkpoint)
+        if state is not None:
+            logs.resume(state)  # log files that didn't change are read from where the last run stopped
+    worker = ig.IngestWorker(logs, stats_period, alert_treshold, merged_treshold, checkpoint_path=args.checkpoint,
+                             publisher=args.publisher)
+    display = dp.Display(myscreen, args.metrics_path)
     myscreen.nodelay(1)
-    while loop:
-        datastruct.fill(log_file)
-        datastruct.compute_stats()
-        display.update_stats(datastruct)
-        datastruct.clear_last()
-        on_alert, to_display = datastruct.compute_alert(alert_treshold, on_alert)
-        display.update_alerts(to_display) # has to be called after clear_last()
-        if display.loop_exit_on_q(stats_period) == 1:
-            loop = False
+    selector = selectors.DefaultSelector()
+    timeout = display.FRAME_MS / 1000.0  # display is refreshed at most once per frame, whatever the traffic
+    try:
+        selector.register(sys.stdin, selectors.EVENT_READ)
+    except (ValueError, OSError):  # e.g. Windows: select only works on sockets, we check keys regularly
+        timeout = display.GETCH_REFRESH_MS / 1000.0
+    worker.start()
+    try:
+        while worker.is_alive():
+            selector.select(timeout)  # sleeps until a key is pressed or next frame
+            if display.exit_on_q() == 1:
+                break
+            snapshots = worker.get_snapshots()
+            for snapshot in snapshots:
+                for source, alert_info in snapshot["alerts"]:
+                    display.update_alerts(alert_info, source)
+            if snapshots:
+                display.update_stats(snapshots[-1])  # statistics of older periods are outdated already
+    finally:
+        worker.stop()
+        selector.close()
+    worker.join()
+    if worker.error is not None:
+        raise worker.error
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='HTTP Monitoring application')
+    parser.add_argument('log_files', help='log files to monitor, paths or glob patterns - default to logs2.txt',
+                        nargs='*', default=["logs2.txt"])
     parser.add_argument('-s', help='monitoring period length in seconds (int)', type = int, default=10, dest="p_stats")
     parser.add_argument('-a', help='alert period length in seconds (int)', type = int, default=120, dest="p_alert")
     parser.add_argument('-t', help='alert treshold in hits/seconds (int)', type=int, default=20, dest="t_alert")
+    parser.add_argument('-g', help='alert treshold of the merged traffic in hits/seconds (int) - default to T_ALERT '
+                                   'times the number of log files', type=int, default=None, dest="g_alert")
+    parser.add_argument('-k', help='count sections and users with a bounded-memory top-k of TOP_K keys (int) '
+                                   '- default to exact counting', type=int, default=None, dest="top_k")
+    parser.add_argument('-l', help='seconds a log line can arrive late and still be counted in alerts (int) - default '
+                                   'to P_STATS', type=int, default=None, dest="lateness")
+    parser.add_argument('-j', help='number of processes parsing a large backlog in parallel, not used with -m (int) '
+                                   '- default to sequential parsing', type=int, default=None, dest="workers")
+    parser.add_argument('-m', help='number of recent requests kept in memory for drill-down queries on the endpoint '
+                                   '(int), about 30 bytes each - default to none', type=int, default=None,
+                        dest="history")
+    parser.add_argument('-R', help='file of alert rules on sections and users, one "kind key threshold" per line, '
+                                   'cf rules module', default=None, dest="rules")
+    parser.add_argument('-M', help='file where monitor metrics are appended as JSON lines when "d" is pressed - '
+                                   'default to metrics.jsonl', default="metrics.jsonl", dest="metrics_path")
+    parser.add_argument('-c', help='checkpoint file: state is saved there every period and when monitoring ends, and '
+                                   'restored on start so that no line nor alert is lost across restarts',
+                        default=None, dest="checkpoint")
+    parser.add_argument('-e', help='local endpoint serving the last statistics, debit and alerts as JSON (/) and in '
+                                   'Prometheus text format (/metrics), and history queries (/history): HOST:PORT, '
+                                   ':PORT for localhost, or unix:PATH for a Unix socket - default to none',
+                        default=None, dest="endpoint")
+    parser.add_argument('-r', '--replay', help='headless mode: replay whole log files ("-" for stdin, .gz '
+                                              'files are decompressed, rotated segments are read oldest first, '
+                                              'different log files are merged in timestamp order) as fast as '
+                                              'possible and print statistics and alerts as JSON lines',
+                        action='store_true')
     args = parser.parse_args()
-    curses.wrapper(main, args) #wrapper so that curses.endwin() is called everytime and we can switch back to normal I/O
+    if args.rules is not None:
+        try:
+            args.rules = rl.load_rules(args.rules)  # errors are reported before curses takes the terminal
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+    if args.replay:
+        if args.history is not None:
+            parser.error("-m keeps requests for the endpoint, which doesn't run with -r")
+        rp.replay(sg.chronological(ml.expand_paths(args.log_files)), args.p_alert, args.p_stats, args.t_alert,
+                  merged_treshold=args.g_alert, rules=args.rules, lateness=args.lateness, top_k=args.top_k)
+        sys.exit(0)
+    args.publisher = None
+    server = None
+    if args.endpoint is not None:
+        args.publisher = ep.SnapshotPublisher()
+        try:
+            server = ep.start_server(args.endpoint, args.publisher)  # bind errors are reported before curses too
+        except (OSError, ValueError) as error:
+            parser.error("endpoint {}: {}".format(args.endpoint, error))
+    try:
+        curses.wrapper(main, args)  # curses.endwin() is called everytime and we switch back to normal I/O
+    finally:
+        if server is not None:
+            ep.stop_server(server)
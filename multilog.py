@@ -0,0 +1,182 @@
+"""
+Multi-log module
+Monitors several log files in a single process: each log file has its own Datastruct and alert state, and every line
+read is also aggregated into a merged Datastruct giving the combined picture.
+"""
+import glob
+import os
+import datastruct as dt
+import metrics as mt
+import rules as rl
+from collections import OrderedDict
+
+
+def expand_paths(patterns):
+    """
+    Expands glob patterns into log file paths. A pattern matching nothing is kept as is so that the file is followed
+    as soon as it is created
+    :param patterns: (list) of strings, paths or glob patterns
+    :return: (list) of unique paths, in the given order
+    """
+    paths = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+class MultiLog:
+    """per-source and merged statistics and alerts over several log files"""
+
+    def __init__(self, paths, alert_period, stats_period, rules=None, **options):
+        """
+        :param paths: (list) of log file paths
+        :param alert_period: (int) alert period length in seconds
+        :param stats_period: (int) monitoring period length in seconds
+        :param rules: (list) of alert rules on the merged traffic, cf rules.parse_rules - optional
+        :param options: other Datastruct arguments (event_time, lateness, top_k, workers, history). Only the merged
+                        Datastruct keeps a history of requests
+        """
+        self.paths = list(paths)
+        history = options.pop("history", None)
+        source_history = history if len(self.paths) == 1 else None
+        self.sources = OrderedDict((path, dt.Datastruct(alert_period, stats_period, history=source_history, **options))
+                                   for path in paths)
+        if len(self.sources) == 1:  # a single source is its own merged view: lines are only aggregated once
+            self.merged = next(iter(self.sources.values()))
+        else:
+            self.merged = dt.Datastruct(alert_period, stats_period, history=history, **options)
+            self.merged.hold_window()  # event time of the merged traffic is the one of the source furthest behind
+        if rules:
+            self.merged.rules = rl.RuleEngine(rules, alert_period, stats_period)
+        self.metrics = mt.Metrics()  # one for every Datastruct: they are all filled by the same thread
+        for datastruct in list(self.sources.values()) + [self.merged]:
+            datastruct.metrics = self.metrics
+        self._on_alert = {path: False for path in self.sources}  # current alert state per source
+        self._on_alert[None] = False  # merged alert state
+
+    def fill(self):
+        """
+        Reads every log file and fills their Datastruct and the merged one
+        :return: None
+        """
+        merged = None if len(self.sources) == 1 else self.merged
+        for path, datastruct in self.sources.items():
+            datastruct.fill(path, merged)
+        self._release_merged()
+
+    def _release_merged(self):
+        """
+        Moves the event time of the merged traffic to the last second closed by every source that has read lines, so
+        that hits of a source lagging behind the others (backlog, late writer) are not dropped as late
+        :return: None
+        """
+        if len(self.sources) == 1 or self.merged.window is None:
+            return
+        watermarks = [datastruct.window.watermark for datastruct in self.sources.values()
+                      if datastruct.window.watermark is not None]
+        if watermarks:
+            self.merged.release_window(min(watermarks))
+
+    def clear_last(self):
+        """
+        Ends the current period for every Datastruct, cf Datastruct.clear_last
+        :return: None
+        """
+        for datastruct in self.sources.values():
+            datastruct.clear_last()
+        if len(self.sources) > 1:
+            self.merged.clear_last()
+
+    def bytes_behind(self):
+        """
+        :return: (int) bytes written to the log files that have not been read yet
+        """
+        return sum(datastruct.bytes_behind() for datastruct in self.sources.values())
+
+    def source_hits(self):
+        """
+        :return: (OrderedDict) {path: number of hits during last period} for every source
+        """
+        return OrderedDict((path, datastruct.last_hits) for path, datastruct in self.sources.items())
+
+    def snapshot(self):
+        """
+        Returns a copy of last period statistics of the merged traffic, cf Datastruct.snapshot
+        :return: (dict): Datastruct.snapshot() keys + ["source_hits"] when there are several log files
+        """
+        snapshot = self.merged.snapshot()
+        if len(self.sources) > 1:
+            snapshot["source_hits"] = self.source_hits()
+        return snapshot
+
+    def alert_states(self):
+        """
+        :return: (dict) {path or None for the merged traffic: True if on alert}, paths only when there are several
+                 log files, cf compute_alerts
+        """
+        if len(self.sources) > 1:
+            return dict(self._on_alert)
+        return {None: self._on_alert[None]}
+
+    def get_state(self):
+        """
+        :return: (dict) state needed to resume monitoring, cf Datastruct.get_state. dict.keys() = ["sources",
+                 "merged", "on_alert", "rules"]: sources is {absolute path: state}, merged the state of the merged
+                 Datastruct (None for a single log file), on_alert {absolute path or None: alert state} and rules
+                 the state of the alert rules, cf rules.RuleEngine.get_state - None without rules
+        """
+        merged = self.merged.get_state() if len(self.sources) > 1 else None
+        return {"sources": {os.path.abspath(path): datastruct.get_state() for path, datastruct in self.sources.items()},
+                "merged": merged,
+                "on_alert": {os.path.abspath(path) if path is not None else None: on_alert
+                             for path, on_alert in self._on_alert.items()},
+                "rules": self.merged.rules.get_state() if self.merged.rules is not None else None}
+
+    def resume(self, state):
+        """
+        Restores a state returned by get_state, before the 1st call to fill. Log files that were not monitored then
+        start from their end as usual
+        :param state: (dict) returned by get_state
+        :return: (list) of paths whose reading resumes at the saved position
+        """
+        resumed = []
+        for path, datastruct in self.sources.items():
+            source_state = state["sources"].get(os.path.abspath(path))
+            if source_state is None:
+                continue
+            self._on_alert[path] = state["on_alert"].get(os.path.abspath(path), False)
+            if datastruct.resume(path, source_state):
+                resumed.append(path)
+        if len(self.sources) > 1 and state["merged"] is not None:
+            self.merged.resume(None, state["merged"])
+        self._on_alert[None] = state["on_alert"].get(None, False)
+        if self.merged.rules is not None and state["rules"] is not None:
+            self.merged.rules.set_state(state["rules"])
+        return resumed
+
+    def compute_alerts(self, alert_treshold, merged_treshold):
+        """
+        Checks alert state of every source and of the merged traffic
+        :param alert_treshold: (int) in hits/second, for each source
+        :param merged_treshold: (int) in hits/second, for the merged traffic
+        :return: (list) of tuples (path, alert_info) for every alert start or recovery, path being None for the merged
+                 traffic and alert_info a dict as returned by Datastruct.compute_alerts. Alert rules, if any, are
+                 evaluated too: their path is the rule name, cf rules.RuleEngine.tick
+        """
+        checks = [(None, self.merged, merged_treshold)]
+        if len(self.sources) > 1:
+            checks += [(path, datastruct, alert_treshold) for path, datastruct in self.sources.items()]
+            for datastruct in self.sources.values():
+                datastruct.advance_clock()  # close the seconds without traffic
+            self._release_merged()
+        else:
+            self.merged.advance_clock()
+        alerts = []
+        for path, datastruct, treshold in checks:
+            self._on_alert[path], transitions = datastruct.compute_alerts(treshold, self._on_alert[path])
+            alerts += [(path, alert_info) for alert_info in transitions]
+        if self.merged.rules is not None:  # on the event time of the merged traffic, if any
+            alerts += self.merged.rules.tick(self.merged.window.watermark if self.merged.window is not None else None)
+        return alerts
@@ -3,12 +3,26 @@ Parser module
 Takes a W3C formated log-line and stores relevant information
 NB: a W3C formated log-line should look like this:
 127.0.0.1 user-identifier frank [10/Oct/2000:13:55:36 -0700] "GET /test/image.jpg HTTP/1.0" 200 2326
+parse() handles one line and returns a dict, parse_batch() handles a whole buffer and returns one list per field
 """
 import re
+import calendar
+from collections import namedtuple
+from functools import lru_cache
 
 W3C_REGEX = re.compile(r'\A\S+ \S+ (?P<userid>\S+) \S+ \S+ "(?P<method>\S+) '
                        r'(?P<request>/(?P<section>[^/]*)(?:/\S*)?) \S+" (?P<status>\d{3}) (?P<size>\d+)')
 STRING_FIELD_LIST = ["userid", "method", "request", "section", "status"]
+# W3C_REGEX anchored on every line of a buffer and only capturing what Datastruct aggregates. Fields are matched
+# without backtracking (bracketed timestamp, no optional group) and can't contain a newline so a match never spans
+# two lines
+BATCH_REGEX = re.compile(r'^\S+ \S+ (\S+) \[([^]\n]*)\] "(\S+) /([^/\s]*)\S* [^"\s]+" (\d{3}) (\d+)', re.MULTILINE)
+
+MONTHS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+          "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
+
+ParsedBatch = namedtuple("ParsedBatch", ["userids", "seconds", "methods", "sections", "statuses", "sizes",
+                                         "malformed"])
 
 
 def parse(log_line):
@@ -26,6 +40,61 @@ def parse(log_line):
         return parsed_line
 
 
+@lru_cache(maxsize=4096)  # many lines share the same timestamp: each distinct one is converted once
+def timestamp_to_epoch(timestamp):
+    """
+    Converts a W3C timestamp to a number of seconds since epoch
+    :param timestamp: (string) e.g. "10/Oct/2000:13:55:36 -0700"
+    :return: (int) seconds since epoch (UTC), None if the timestamp is malformed
+    """
+    try:
+        utc = calendar.timegm((int(timestamp[7:11]), MONTHS[timestamp[3:6]], int(timestamp[0:2]),
+                               int(timestamp[12:14]), int(timestamp[15:17]), int(timestamp[18:20])))
+        offset = int(timestamp[22:24]) * 3600 + int(timestamp[24:26]) * 60
+    except (KeyError, ValueError):
+        return None
+    if timestamp[21:22] == "-":
+        return utc + offset
+    return utc - offset
+
+
+def parse_batch(log_lines):
+    """
+    Parses many log lines at once: one regex scan over the whole buffer, no dict built per line and malformed lines
+    are counted instead of printed
+    :param log_lines: (bytes, string or list of strings) log lines, separated by newlines if bytes or string
+    :return: (ParsedBatch) userids, methods, sections, statuses (lists of strings), seconds (list of int, None for a
+             malformed timestamp), sizes (list of int) - one item per well-formed line in file order - and
+             malformed (int), number of lines that could not be parsed
+    """
+    if isinstance(log_lines, bytes):
+        log_lines = log_lines.decode("utf-8", "replace")
+    elif not isinstance(log_lines, str):
+        log_lines = "\n".join(log_lines)
+    nb_lines = log_lines.count("\n")
+    if log_lines and not log_lines.endswith("\n"):
+        nb_lines += 1
+    matches = BATCH_REGEX.findall(log_lines)  # list of tuples, built in C
+    if not matches:
+        return ParsedBatch([], [], [], [], [], [], nb_lines)
+    userids, timestamps, methods, sections, statuses, sizes = zip(*matches)
+    return ParsedBatch(list(userids), list(map(timestamp_to_epoch, timestamps)), list(methods), list(sections),
+                       list(statuses), list(map(int, sizes)), nb_lines - len(matches))
+
+
+def slice_batch(batch, start, end=None):
+    """
+    Returns the lines of a batch between two indexes
+    :param batch: (ParsedBatch) parsed lines
+    :param start: (int) index of the first line
+    :param end: (int) index after the last line, end of batch if None
+    :return: (ParsedBatch) lines [start:end], malformed lines are attributed to the slice starting at 0
+    """
+    return ParsedBatch(batch.userids[start:end], batch.seconds[start:end], batch.methods[start:end],
+                       batch.sections[start:end], batch.statuses[start:end], batch.sizes[start:end],
+                       batch.malformed if start == 0 else 0)
+
+
 if __name__ == '__main__':
     string = '127.0.0.1 user-identifier frank [10/Oct/2000:13:55:36 -0700] "GET /test/image.jpg HTTP/1.0" 200 2326'
     parsed = parse(string)
@@ -0,0 +1,232 @@
+"""
+Replay module
+Streams historical logs through a Datastruct as fast as the CPU allows. The clock is taken from the log timestamps:
+a period ends when a line timestamped after its end is read, not after a sleep. Statistics of every period and every
+alert start or recovery are written as JSON lines, e.g.:
+{"type":"stats","start":1487094629,"end":1487094639,"last_hits":212,"top_sections":[["fruits",80],...],...}
+{"type":"alert","status_code":1,"debit":25,"time":1487094700}
+Several log files are replayed together: their lines are merged in timestamp order so that the traffic of each one
+lands in the periods and alert window of its own time. As when monitoring, each log file also has its own alerts,
+whose records have a "source" key, and alert rules are evaluated on the merged traffic.
+"""
+import heapq
+import itertools
+import json
+import sys
+import datastruct as dt
+import regex_parser as rp
+import rules as rl
+import segments as sg
+import tailer as tl
+from collections import OrderedDict
+
+MERGE_SIZE = 1 << 14  # lines merged across log files handed to the replayer at once
+
+
+class Replayer:
+    """feeds log chunks to Datastructs on a simulated clock and writes statistics and alerts as JSON lines"""
+
+    def __init__(self, alert_period, stats_period, alert_treshold, output=sys.stdout, sources=None,
+                 merged_treshold=None, rules=None, **options):
+        """
+        :param alert_period: (int) alert period length in seconds
+        :param stats_period: (int) monitoring period length in seconds
+        :param alert_treshold: (int) in hits/second, for each log file
+        :param output: (file) where JSON lines are written
+        :param sources: (list) of log file names, when several log files are replayed together - optional
+        :param merged_treshold: (int) in hits/second, for the merged traffic - default to alert_treshold times the
+                                number of log files
+        :param rules: (list) of alert rules on the merged traffic, cf rules.parse_rules - optional
+        :param options: other Datastruct arguments (lateness, top_k)
+        """
+        self.datastruct = dt.Datastruct(alert_period, stats_period, event_time=True, **options)
+        if rules:
+            self.datastruct.rules = rl.RuleEngine(rules, alert_period, stats_period)
+        self.sources = OrderedDict((source, dt.Datastruct(alert_period, stats_period, event_time=True, **options))
+                                   for source in sources or [])
+        self.stats_period = stats_period
+        self.alert_treshold = alert_treshold
+        self.merged_treshold = merged_treshold if merged_treshold is not None else \
+            alert_treshold * max(1, len(self.sources))
+        self.output = output
+        self.on_alert = dict.fromkeys([None] + list(self.sources), False)  # {source or None for the merged traffic}
+        self.period_end = None  # end of current period, in seconds since epoch, set by the 1st timestamp
+
+    def _write(self, record):
+        self.output.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def _end_period(self):
+        """
+        Writes current period statistics and the alerts raised up to its end, then starts next period
+        :return: None
+        """
+        for datastruct in [self.datastruct] + list(self.sources.values()):
+            datastruct.window.advance(self.period_end)  # simulated clock: no line may be needed to close seconds
+        record = {"type": "stats", "start": self.period_end - self.stats_period, "end": self.period_end}
+        record.update(self.datastruct.snapshot())  # debit over the alert period ending with this period
+        if self.sources:
+            record["source_hits"] = {source: datastruct.last_hits for source, datastruct in self.sources.items()}
+        self._write(record)
+        for datastruct in [self.datastruct] + list(self.sources.values()):
+            datastruct.clear_last()
+        self._write_alerts()
+        self.period_end += self.stats_period
+
+    def _write_alerts(self):
+        checks = [(None, self.datastruct, self.merged_treshold)]
+        checks += [(source, datastruct, self.alert_treshold) for source, datastruct in self.sources.items()]
+        for source, datastruct, treshold in checks:
+            self.on_alert[source], transitions = datastruct.compute_alerts(treshold, self.on_alert[source])
+            for alert_info in transitions:
+                record = {"type": "alert"} if source is None else {"type": "alert", "source": source}
+                record.update(alert_info)
+                self._write(record)
+        if self.datastruct.rules is not None:
+            for name, alert_info in self.datastruct.rules.tick(self.datastruct.window.watermark):
+                record = {"type": "alert", "source": name}
+                record.update(alert_info)
+                self._write(record)
+
+    def feed(self, chunk):
+        """
+        Processes a block of complete log lines, ending as many periods as its timestamps cover
+        :param chunk: (bytes) log lines
+        :return: None
+        """
+        self.feed_batch(rp.parse_batch(chunk))
+
+    def feed_batch(self, batch, origins=None):
+        """
+        Processes parsed log lines, ending as many periods as their timestamps cover
+        :param batch: (regex_parser.ParsedBatch) parsed lines
+        :param origins: (list) index in sources of the log file of each line, when there are several - optional
+        :return: None
+        """
+        start = 0
+        for index, second in enumerate(batch.seconds):
+            if second is None:
+                continue
+            if self.period_end is None:
+                self.period_end = second + self.stats_period
+            if second >= self.period_end:  # lines before index belong to the period(s) being ended
+                self._fill(batch, origins, start, index)
+                start = index
+                while second >= self.period_end:
+                    self._end_period()
+        self._fill(batch, origins, start)
+
+    def _fill(self, batch, origins, start, end=None):
+        """
+        Fills the merged traffic and the log file of each line with the lines of a batch between two indexes
+        :param batch: (regex_parser.ParsedBatch) parsed lines
+        :param origins: (list) index in sources of the log file of each line, None for a single log file
+        :param start: (int) index of the first line
+        :param end: (int) index after the last line, end of batch if None
+        :return: None
+        """
+        lines = rp.slice_batch(batch, start, end)
+        self.datastruct.fill_with_batch(lines)
+        if origins is None:
+            return
+        lines_origins = origins[start:end]
+        for index, datastruct in enumerate(self.sources.values()):
+            kept = [origin == index for origin in lines_origins]
+            datastruct.fill_with_batch(rp.ParsedBatch(*[list(itertools.compress(column, kept))
+                                                        for column in lines[:-1]], malformed=0))
+
+    def finish(self):
+        """
+        Ends the last period and closes every second read so that the last alerts are written
+        :return: None
+        """
+        if self.period_end is None:  # nothing read
+            return
+        self._end_period()
+        for datastruct in [self.datastruct] + list(self.sources.values()):
+            window = datastruct.window
+            if window.head is not None:
+                window.advance(window.head + window.lateness + 1)
+        self._write_alerts()
+
+
+def _read_chunks(paths):
+    """
+    Reads log files one after the other, "-" standing for stdin. Gzip-compressed files (.gz) are decompressed on the
+    fly
+    :param paths: (list) of log file paths
+    :return: (generator) blocks of complete lines (bytes)
+    """
+    for path in paths:
+        if path == "-":
+            yield from tl.read_stream_chunks(sys.stdin.buffer)
+            continue
+        with sg.open_segment(path) as log_file:
+            yield from tl.read_stream_chunks(log_file)
+
+
+def _read_rows(paths, malformed, origin):
+    """
+    :param paths: (list) of log file paths, cf _read_chunks
+    :param malformed: (list) whose 1st item is increased by the number of malformed lines read
+    :param origin: (int) index of the log file
+    :return: (generator) tuples (second, userid, method, section, status, size, origin), one per well-formed line,
+             second being 0 for a malformed timestamp
+    """
+    for chunk in _read_chunks(paths):
+        batch = rp.parse_batch(chunk)
+        malformed[0] += batch.malformed
+        yield from zip([second or 0 for second in batch.seconds], batch.userids, batch.methods, batch.sections,
+                       batch.statuses, batch.sizes, itertools.repeat(origin))
+
+
+def _merge_batches(groups):
+    """
+    Merges the lines of several log files in timestamp order. Each log file is expected to be (about) in order
+    :param groups: (list) of lists of paths, the segments of each log file in chronological order
+    :return: (generator) of tuples (regex_parser.ParsedBatch, list of the index in groups of the log file of each
+             line), MERGE_SIZE lines each
+    """
+    malformed = [0]
+    rows = heapq.merge(*[_read_rows(paths, malformed, origin) for origin, paths in enumerate(groups)],
+                       key=lambda row: row[0])
+    while True:
+        merged = list(itertools.islice(rows, MERGE_SIZE))
+        if not merged:
+            break
+        seconds, userids, methods, sections, statuses, sizes, origins = map(list, zip(*merged))
+        yield rp.ParsedBatch(userids, [second or None for second in seconds], methods, sections, statuses, sizes,
+                             malformed[0]), origins
+        malformed[0] = 0
+    if malformed[0]:
+        yield rp.ParsedBatch([], [], [], [], [], [], malformed[0]), []
+
+
+def replay(paths, alert_period, stats_period, alert_treshold, output=sys.stdout, merged_treshold=None, rules=None,
+           **options):
+    """
+    Replays log files, "-" standing for stdin. The segments of a log file are read one after the other, different
+    log files are merged in timestamp order, cf module docstring
+    :param paths: (list) of log file paths, in chronological order, cf segments.chronological
+    :param alert_period: (int) alert period length in seconds
+    :param stats_period: (int) monitoring period length in seconds
+    :param alert_treshold: (int) in hits/second, for each log file
+    :param output: (file) where JSON lines are written
+    :param merged_treshold: (int) in hits/second, for the merged traffic - default to alert_treshold times the number
+                            of log files
+    :param rules: (list) of alert rules on the merged traffic, cf rules.parse_rules - optional
+    :param options: other Datastruct arguments (lateness, top_k)
+    :return: (Replayer) replayer, holding the final state
+    """
+    groups = OrderedDict()
+    for path in paths:
+        groups.setdefault(sg.split_segment(path)[0], []).append(path)
+    replayer = Replayer(alert_period, stats_period, alert_treshold, output, list(groups) if len(groups) > 1 else None,
+                        merged_treshold, rules, **options)
+    if len(groups) == 1:  # a single log file is in order already: no line by line merge
+        for chunk in _read_chunks(paths):
+            replayer.feed(chunk)
+    else:
+        for batch, origins in _merge_batches(list(groups.values())):
+            replayer.feed_batch(batch, origins)
+    replayer.finish()
+    return replayer
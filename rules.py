@@ -0,0 +1,295 @@
+"""
+Rules module
+Alert rules on parts of the traffic, each with its own threshold and state: hits/s of a section, percentage of 5xx
+responses of a section, hits/s of a user. A rules file has one rule per line, "*" giving a rule to every key seen:
+    # kind        key     threshold
+    section_hits  fruits  20
+    section_5xx   *       5
+    user_hits     *       10
+Rules of a kind are held in arrays indexed by rule (keys, thresholds, states and hits over the alert period), so
+that thousands of them are evaluated with a few passes over the arrays at the end of each period instead of one call
+per rule. Triggers and recoveries are reported as the dicts Display.update_alerts takes.
+Rules a wildcard gave to a key are dropped once the key is idle over the whole alert period and not on alert, so
+that their number follows the active keys and not every key ever seen.
+Like the alert window, rules run on event time: hits are counted per second of their timestamp and each period
+closes the seconds up to the watermark of the window, the others wait for a later period. Hits of the closed seconds
+are summed per key over the alert period ending at the watermark, older seconds leave the sums and late hits, whose
+second was closed already, are dropped: a backlog read at once counts as the traffic of its last alert period only.
+"""
+import time
+from array import array
+from collections import Counter
+
+KINDS = {"section_hits": ("section", "Hits/s"),  # kind: (label of the key, metric displayed)
+         "section_5xx": ("section", "5xx %"),
+         "user_hits": ("user", "Hits/s")}
+WILDCARD = "*"
+MIN_RATIO_HITS = 10  # 5xx percentage is not evaluated below this number of hits over the alert period
+
+
+def parse_rules(lines):
+    """
+    :param lines: (iterable) of rule lines, cf module docstring. Blank lines and comments (#) are skipped
+    :return: (list) of tuples (kind, key, threshold)
+    """
+    rules = []
+    for number, line in enumerate(lines, 1):
+        fields = line.split("#", 1)[0].split()
+        if not fields:
+            continue
+        try:
+            kind, key, threshold = fields
+            threshold = float(threshold)
+        except ValueError:
+            raise ValueError("rule line {}: expected 'kind key threshold', got {!r}".format(number, line.strip()))
+        if kind not in KINDS:
+            raise ValueError("rule line {}: unknown kind {}, expected one of {}".format(number, kind, sorted(KINDS)))
+        rules.append((kind, key, threshold))
+    return rules
+
+
+def load_rules(path):
+    """
+    :param path: (string) rules file path
+    :return: (list) of tuples (kind, key, threshold), cf parse_rules
+    """
+    with open(path) as rules_file:
+        return parse_rules(rules_file)
+
+
+class RuleSet:
+    """rules of one kind: one threshold and one alert state per key"""
+
+    def __init__(self, kind):
+        """
+        :param kind: (string) one of KINDS
+        """
+        self.kind = kind
+        self.label, self.metric = KINDS[kind]
+        self.keys = []  # key of each rule
+        self._index = {}  # {key: rule index}
+        self._explicit = bytearray()  # 1 if the rule comes from the rules file, 0 if a wildcard gave it to its key
+        self.default = None  # threshold given to new keys, None if there is no wildcard rule
+        self.thresholds = array('d')
+        self.states = bytearray()  # 1 if the rule is on alert
+        self.hits = array('q')  # hits of each rule over the alert period
+        self.totals = array('q')  # total hits of the key, for ratio rules
+
+    def add(self, key, threshold, explicit=True):
+        """
+        Adds a rule, or changes its threshold if the key has one already
+        :param key: (string) key of the rule, WILDCARD for every key without a rule of its own
+        :param threshold: (float) alert threshold
+        :param explicit: (bool) False if the rule is given by a wildcard, it is then dropped once its key is idle
+        :return: None
+        """
+        if key == WILDCARD:
+            self.default = threshold
+            return
+        if key in self._index:
+            self.thresholds[self._index[key]] = threshold
+            return
+        self._index[key] = len(self.keys)
+        self.keys.append(key)
+        self._explicit.append(explicit)
+        self.thresholds.append(threshold)
+        self.states.append(0)
+        self.hits.append(0)
+        self.totals.append(0)
+
+    def _drop_idle(self):
+        """
+        Drops the wildcard rules whose key had no hit over the alert period and which are not on alert
+        :return: None
+        """
+        rules = zip(self._explicit, self.hits, self.totals, self.states)
+        kept = [index for index, rule in enumerate(rules) if any(rule)]
+        if len(kept) == len(self.keys):
+            return
+        self.keys = [self.keys[index] for index in kept]
+        self._index = {key: index for index, key in enumerate(self.keys)}
+        self._explicit = bytearray(self._explicit[index] for index in kept)
+        self.thresholds = array('d', [self.thresholds[index] for index in kept])
+        self.states = bytearray(self.states[index] for index in kept)
+        self.hits = array('q', [self.hits[index] for index in kept])
+        self.totals = array('q', [self.totals[index] for index in kept])
+
+    def tick(self, hits, totals, alert_period):
+        """
+        Evaluates every rule over the alert period
+        :param hits: (dict) {key: hits counted by the rules over the alert period}
+        :param totals: (dict) {key: all hits over the alert period}, for ratio rules
+        :param alert_period: (int) alert period length in seconds
+        :return: (list) of tuples (rule index, status code, value) for every trigger (1) and recovery (0)
+        """
+        if self.default is not None:
+            self._drop_idle()
+            for key in hits.keys() - self._index.keys():
+                self.add(key, self.default, explicit=False)
+        self.hits = array('q', [hits.get(key, 0) for key in self.keys])
+        if self.kind == "section_5xx":
+            self.totals = array('q', [totals.get(key, 0) for key in self.keys])
+            values = [100.0 * hits / total if total >= MIN_RATIO_HITS else 0.0
+                      for hits, total in zip(self.hits, self.totals)]
+        else:
+            values = [float(hits) / alert_period for hits in self.hits]
+        states = bytearray(value >= threshold for value, threshold in zip(values, self.thresholds))
+        if states == self.states:  # most periods: nothing changed, no loop over the rules
+            return []
+        transitions = [(index, state, values[index])
+                       for index, (state, previous) in enumerate(zip(states, self.states)) if state != previous]
+        self.states = states
+        return transitions
+
+
+class RuleEngine:
+    """counts the lines read for every rule and evaluates the rules at the end of each period"""
+
+    def __init__(self, rules, alert_period, stats_period):
+        """
+        :param rules: (list) of tuples (kind, key, threshold), cf parse_rules
+        :param alert_period: (int) alert period length in seconds
+        :param stats_period: (int) monitoring period length in seconds
+        """
+        self.alert_period = alert_period
+        self.stats_period = stats_period
+        self.rule_sets = {kind: RuleSet(kind) for kind in KINDS}
+        for kind, key, threshold in rules:
+            self.rule_sets[kind].add(key, threshold)
+        self.watermark = None  # last second closed, None before the 1st period
+        self.dropped_hits = 0  # hits late or older than the alert period when read, and malformed timestamps
+        # hits per (second, section), 5xx per (second, section) and hits per (second, user) not closed yet
+        self._pending = (Counter(), Counter(), Counter())
+        self._seconds = {}  # {closed second of the alert period: (hits per section, 5xx per section, hits per user)}
+        self._sums = (Counter(), Counter(), Counter())  # the same counts summed over the alert period
+
+    def add_batch(self, batch):
+        """
+        Counts a batch of parsed lines
+        :param batch: (regex_parser.ParsedBatch) parsed lines
+        :return: None
+        """
+        sections, server_errors, users = self._pending
+        sections.update(zip(batch.seconds, batch.sections))  # pairs are counted in C
+        server_errors.update((second, section) for second, section, status
+                             in zip(batch.seconds, batch.sections, batch.statuses) if status[0] == "5")
+        users.update(zip(batch.seconds, batch.userids))
+
+    def add_counts(self, sections, server_errors, users):
+        """
+        Counts aggregated lines, e.g. a shard
+        :param sections: (dict) {(second, section): hits}
+        :param server_errors: (dict) {(second, section): 5xx}
+        :param users: (dict) {(second, user): hits}
+        :return: None
+        """
+        for pending, counts in zip(self._pending, (sections, server_errors, users)):
+            pending.update(counts)
+
+    def _count(self, index, second, key, hits):
+        """
+        Counts hits of a closed second in the alert period
+        :param index: (int) index of the count: 0 for section hits, 1 for section 5xx, 2 for user hits
+        :return: None
+        """
+        if second not in self._seconds:
+            self._seconds[second] = (Counter(), Counter(), Counter())
+        self._seconds[second][index][key] += hits
+        self._sums[index][key] += hits
+
+    def _close(self, watermark):
+        """
+        Moves the hits of the seconds up to watermark into the alert period, and drops the seconds leaving it
+        :param watermark: (int) last second closed
+        :return: None
+        """
+        oldest = watermark - self.alert_period  # last second out of the alert period
+        floor = oldest if self.watermark is None else max(oldest, self.watermark)  # seconds not taken anymore
+        for index, pending in enumerate(self._pending):
+            later = Counter()
+            for (second, key), hits in pending.items():
+                if second is None or second <= floor:  # malformed timestamp, late or out of the alert period
+                    self.dropped_hits += hits if index == 0 else 0  # every line has a section: counted once
+                elif second > watermark:
+                    later[(second, key)] = hits
+                else:
+                    self._count(index, second, key, hits)
+            self._pending[index].clear()
+            self._pending[index].update(later)
+        for second in [second for second in self._seconds if second <= oldest]:
+            for sums, counts in zip(self._sums, self._seconds.pop(second)):
+                sums.subtract(counts)
+                for key in counts:
+                    if sums[key] <= 0:  # idle over the alert period: its wildcard rule can be dropped
+                        del sums[key]
+        self.watermark = watermark
+
+    def tick(self, watermark=None):
+        """
+        Ends the current period and evaluates every rule over the alert period ending at the watermark
+        :param watermark: (int) last second closed in event time: later hits wait for the next periods - None without
+                          event time: the hits counted during the period are taken as its last second
+        :return: (list) of tuples (rule name, alert_info) for every trigger or recovery. alert_info is a dict as
+                 returned by Datastruct.compute_alerts, with keys "rule" and "metric" in addition
+        """
+        now = watermark
+        if watermark is None:
+            now = time.time()
+            watermark = (self.watermark if self.watermark is not None else 0) + self.stats_period
+            for pending in self._pending:
+                hits = Counter()
+                for (_, key), count in pending.items():
+                    hits[(watermark, key)] += count
+                pending.clear()
+                pending.update(hits)
+        self._close(watermark)
+        sections, server_errors, users = self._sums
+        counts = {"section_hits": (sections, None), "section_5xx": (server_errors, sections),
+                  "user_hits": (users, None)}
+        alerts = []
+        for kind, rule_set in self.rule_sets.items():
+            hits, totals = counts[kind]
+            for index, status_code, value in rule_set.tick(hits, totals, self.alert_period):
+                rule = "{} {}".format(rule_set.label, rule_set.keys[index])
+                alerts.append(("{} {}".format(kind, rule_set.keys[index]),
+                               {"status_code": status_code, "debit": round(value), "time": now, "rule": rule,
+                                "metric": rule_set.metric}))
+        return alerts
+
+    def get_state(self):
+        """
+        :return: (dict) state needed to resume evaluating the rules after a restart, cf set_state. dict.keys() =
+                 ["watermark", "on_alert", "counts"]: on_alert is {kind: keys of the rules on alert} and counts a list
+                 of tuples (index of the count, second, key, hits) of the alert period and of the seconds not closed
+                 yet, the index being 0 for section hits, 1 for section 5xx and 2 for user hits
+        """
+        on_alert = {kind: [key for key, state in zip(rule_set.keys, rule_set.states) if state]
+                    for kind, rule_set in self.rule_sets.items()}
+        counts = [(index, second, key, hits)
+                  for second, second_counts in self._seconds.items()
+                  for index, keys in enumerate(second_counts) for key, hits in keys.items()]
+        counts += [(index, second, key, hits)
+                   for index, pending in enumerate(self._pending) for (second, key), hits in pending.items()
+                   if second is not None]
+        return {"watermark": self.watermark, "on_alert": on_alert, "counts": counts}
+
+    def set_state(self, state):
+        """
+        Restores a state returned by get_state, before the 1st period. Rules on alert that are not in the rules file
+        anymore are ignored, unless a wildcard gives them a threshold
+        :param state: (dict) returned by get_state
+        :return: None
+        """
+        for kind, keys in state["on_alert"].items():
+            rule_set = self.rule_sets[kind]
+            for key in keys:
+                if key not in rule_set._index and rule_set.default is not None:
+                    rule_set.add(key, rule_set.default, explicit=False)
+                if key in rule_set._index:
+                    rule_set.states[rule_set._index[key]] = 1  # its recovery is reported as usual
+        self.watermark = state["watermark"]
+        for index, second, key, hits in state["counts"]:
+            if self.watermark is None or second > self.watermark:
+                self._pending[index][(second, key)] += hits
+                continue
+            self._count(index, second, key, hits)
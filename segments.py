@@ -0,0 +1,102 @@
+"""
+Segments module
+Finds and reads the rotated segments of a log file (access.log.1, access.log.2.gz, ... the higher the number the older
+the segment), compressed or not. Compressed segments are decompressed as a stream, chunk by chunk, never as a whole.
+A segment is recognized by the fingerprint of its first bytes: rotation and compression change the path and the inode
+of a file but not its beginning.
+"""
+import glob
+import gzip
+import re
+import zlib
+from collections import OrderedDict
+
+FINGERPRINT_SIZE = 1024  # bytes at the beginning of a file identifying it
+SEGMENT_REGEX = re.compile(r'^(.*)\.(\d+)(\.gz)?$')  # base path, rotation number, compression
+
+
+def open_segment(path):
+    """
+    :param path: (string) path to a log file or segment, gzip-compressed if its name ends with .gz
+    :return: (file) binary stream of the uncompressed content
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def fingerprint(data):
+    """
+    :param data: (bytes) first bytes of a file, at most FINGERPRINT_SIZE
+    :return: (tuple) (length, CRC32) of data
+    """
+    return len(data), zlib.crc32(data)
+
+
+def split_segment(path):
+    """
+    :param path: (string) path to a log file or segment
+    :return: (string, int) path of the live log file, rotation number (0 for the live log file)
+    """
+    match = SEGMENT_REGEX.match(path)
+    if match is None:
+        return path, 0
+    return match.group(1), int(match.group(2))
+
+
+def rotated_segments(path):
+    """
+    :param path: (string) path to the live log file
+    :return: (list) of paths of its rotated segments, most recent first. While a segment is being compressed, only
+             its uncompressed version is listed
+    """
+    segments = {}  # {rotation number: path}
+    for candidate in sorted(glob.glob(glob.escape(path) + ".*"), reverse=True):  # access.log.1 after access.log.1.gz
+        base, number = split_segment(candidate)
+        if base == path and number > 0:
+            segments[number] = candidate
+    return [segments[number] for number in sorted(segments)]
+
+
+def segment_fingerprint(path, length):
+    """
+    :param path: (string) path to a log file or segment
+    :param length: (int) number of bytes to fingerprint
+    :return: (tuple) fingerprint of the first length bytes of the uncompressed content, None if it can't be read
+    """
+    try:
+        with open_segment(path) as segment:
+            return fingerprint(segment.read(length))
+    except (OSError, EOFError, zlib.error):  # gzip.BadGzipFile is an OSError
+        return None
+
+
+def find_unread(path, file_fingerprint, position):
+    """
+    Looks among the rotated segments of a log file for the one that was being read, to read its remainder and the
+    segments rotated after it
+    :param path: (string) path to the live log file
+    :param file_fingerprint: (tuple) fingerprint of the file that was being read
+    :param position: (int) offset of the first unread byte in that file
+    :return: (list) of tuples (segment path, offset where reading starts), in the order they have to be read. None if
+             no segment matches
+    """
+    segments = rotated_segments(path)
+    for index, segment in enumerate(segments):
+        if segment_fingerprint(segment, file_fingerprint[0]) == tuple(file_fingerprint):
+            return [(segment, position)] + [(newer, 0) for newer in reversed(segments[:index])]
+    return None
+
+
+def chronological(paths):
+    """
+    Orders the segments of each log file from the oldest to the live one, e.g. for a replay. Log files keep the
+    order in which they first appear
+    :param paths: (list) of paths to log files and segments
+    :return: (list) of the same paths
+    """
+    groups = OrderedDict()
+    for path in paths:
+        base, number = split_segment(path)
+        groups.setdefault(base, []).append((number, path))
+    return [path for group in groups.values() for _, path in sorted(group, key=lambda item: -item[0])]
@@ -0,0 +1,156 @@
+"""
+Shard module
+Parallel catch-up: when a large byte range of a log file is unread (restart, stall), it is split into newline-aligned
+shards that a process pool parses and aggregates into partial counters. Partials are small compared to the lines
+they summarize and are merged into the Datastruct in file order, so that the alert window sees seconds in order.
+Workers open the log file by path: each checks that it is still the file being followed (same inode and same
+fingerprint) and gives up otherwise, e.g. after a rotation, the tailer then reads the backlog from its own handle.
+Worker processes are started by a fork server (spawned on Windows), not forked from the monitor which runs threads.
+"""
+import multiprocessing
+import os
+from collections import Counter
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import histogram as hg
+import regex_parser as rp
+import segments as sg
+import tailer as tl
+
+MIN_SHARD_SIZE = 8 << 20  # 8 MiB: below this, process start and result transfer cost more than they save
+
+ShardResult = namedtuple("ShardResult", ["sections", "users", "errors", "hits", "traffic", "malformed", "seconds",
+                                         "sizes", "section_sizes", "rule_counts", "end"])
+_pools = {}  # {number of workers: ProcessPoolExecutor}, shared by every Datastruct
+
+
+def get_pool(workers):
+    """
+    :param workers: (int) number of worker processes
+    :return: (ProcessPoolExecutor) pool, created on 1st call and reused afterwards
+    """
+    if workers not in _pools:
+        start_methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in start_methods else "spawn")
+        _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    return _pools[workers]
+
+
+def shard_ranges(path, start, end, nb_shards):
+    """
+    Splits a byte range of a file into ranges starting right after a newline
+    :param path: (string) path to the file
+    :param start: (int) offset of the first byte, at the beginning of a line
+    :param end: (int) offset after the last byte
+    :param nb_shards: (int) number of shards wanted
+    :return: (list) of tuples (start, end), contiguous and in file order, possibly fewer than nb_shards
+    """
+    nb_shards = max(1, min(nb_shards, (end - start) // MIN_SHARD_SIZE))
+    bounds = [start]
+    with open(path, 'rb') as log_file:
+        for index in range(1, nb_shards):
+            log_file.seek(max(bounds[-1], start + (end - start) * index // nb_shards))
+            log_file.readline()  # goes to the beginning of next line
+            bound = min(log_file.tell(), end)
+            if bound > bounds[-1]:
+                bounds.append(bound)
+    bounds.append(end)
+    return [(bounds[index], bounds[index + 1]) for index in range(len(bounds) - 1) if bounds[index + 1] > bounds[index]]
+
+
+def _is_followed_file(log_file, identity, fingerprint):
+    """
+    :param log_file: (file) binary handle opened by a worker
+    :param identity: (tuple) (st_dev, st_ino) of the file followed by the tailer, None not to check it
+    :param fingerprint: (tuple) fingerprint of the file followed by the tailer, None not to check it
+    :return: (bool) True if the handle is on the file followed by the tailer
+    """
+    if identity is not None:
+        stat = os.fstat(log_file.fileno())
+        if (stat.st_dev, stat.st_ino) != tuple(identity):
+            return False
+    if fingerprint is not None:
+        log_file.seek(0)
+        if sg.fingerprint(log_file.read(fingerprint[0])) != tuple(fingerprint):
+            return False
+    return True
+
+
+def aggregate_shard(path, start, end, identity=None, fingerprint=None, by_second=False):
+    """
+    Parses and aggregates the complete lines of a byte range. Runs in a worker process
+    :param path: (string) path to the file
+    :param start: (int) offset of the first byte, at the beginning of a line
+    :param end: (int) offset after the last byte
+    :param identity: (tuple) (st_dev, st_ino) the file must have, cf Tailer.identity - optional
+    :param fingerprint: (tuple) fingerprint the file must have, cf Tailer.fingerprint - optional
+    :param by_second: (bool) also counts sections, 5xx sections and users per second, for alert rules
+    :return: (ShardResult) counters of sections, users and error sections, hits, bytes traffic, malformed lines,
+             {second: hits}, histograms of sizes, global and per section, counters of (second, section),
+             (second, 5xx section) and (second, user) - None unless by_second - and end, offset after the last
+             complete line aggregated. None if path is not the expected file anymore
+    """
+    rule_counts = (Counter(), Counter(), Counter()) if by_second else None
+    result = ShardResult(Counter(), Counter(), Counter(), 0, 0, 0, Counter(), hg.LogHistogram(), hg.KeyedHistograms(),
+                         rule_counts, start)
+    hits = traffic = malformed = 0
+    with open(path, 'rb') as log_file:
+        if not _is_followed_file(log_file, identity, fingerprint):
+            return None
+        log_file.seek(start)
+        remaining = end - start
+        partial = b""
+        while remaining > 0:
+            chunk = log_file.read(min(tl.CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            cut = chunk.rfind(b"\n") + 1
+            if cut == 0:
+                partial += chunk
+                continue
+            batch = rp.parse_batch(partial + chunk[:cut])
+            partial = chunk[cut:]
+            result.sections.update(batch.sections)
+            result.users.update(batch.userids)
+            result.errors.update(section for section, status in zip(batch.sections, batch.statuses)
+                                 if status[0] in "45")
+            if by_second:
+                rule_counts[0].update(zip(batch.seconds, batch.sections))
+                rule_counts[1].update((second, section) for second, section, status
+                                      in zip(batch.seconds, batch.sections, batch.statuses) if status[0] == "5")
+                rule_counts[2].update(zip(batch.seconds, batch.userids))
+            result.seconds.update(batch.seconds)
+            indexes = hg.bucket_indexes(batch.sizes)
+            result.sizes.add_indexes(indexes, max(batch.sizes, default=None))
+            result.section_sizes.add_indexes(batch.sections, indexes, batch.sizes)
+            hits += len(batch.sizes)
+            traffic += sum(batch.sizes)
+            malformed += batch.malformed
+        consumed = end - remaining - len(partial)  # an incomplete last line is left to the tailer
+    result.seconds.pop(None, None)
+    return result._replace(hits=hits, traffic=traffic, malformed=malformed, end=consumed)
+
+
+def aggregate_range(path, start, end, workers, identity=None, fingerprint=None, by_second=False):
+    """
+    Parses and aggregates a byte range of a file on several processes
+    :param path: (string) path to the file
+    :param start: (int) offset of the first byte, at the beginning of a line
+    :param end: (int) offset after the last byte
+    :param workers: (int) number of worker processes
+    :param identity: (tuple) (st_dev, st_ino) the file must have, cf Tailer.identity - optional
+    :param fingerprint: (tuple) fingerprint the file must have, cf Tailer.fingerprint - optional
+    :param by_second: (bool) also counts per second for alert rules, cf aggregate_shard
+    :return: (list) of ShardResult, in file order. Shards are contiguous: the last end is where reading must resume.
+             None if path is not the expected file anymore (rotated): the range has to be read from the tailer
+    """
+    path = os.path.abspath(path)
+    ranges = shard_ranges(path, start, end, workers * 4)  # several shards per worker to balance the load
+    pool = get_pool(workers)
+    futures = [pool.submit(aggregate_shard, path, shard_start, shard_end, identity, fingerprint, by_second)
+               for shard_start, shard_end in ranges]
+    shards = [future.result() for future in futures]
+    if None in shards:
+        return None
+    return shards
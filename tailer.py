@@ -0,0 +1,262 @@
+"""
+Tailer module
+Follows an actively written-to log file. The file handle is kept open between reads and new content is read in large
+binary chunks: we only hand back complete lines, a partial trailing line is carried over to the next read.
+Rotation (the path now points to another file) and truncation (the file shrank below our position) are detected on
+every read so that lines are neither lost nor counted twice. Lines written to a file after our last read and before
+it was rotated out of our reach (copytruncate, restart) are read back from its rotated segment, compressed or not.
+"""
+import os
+import segments as sg
+
+CHUNK_SIZE = 1 << 20  # 1 MiB per read() call: one syscall for thousands of lines
+
+
+def read_stream_chunks(stream, chunk_size=CHUNK_SIZE):
+    """
+    Reads a binary stream (e.g. a whole log file or stdin) up to its end
+    :param stream: (io.RawIOBase or io.BufferedIOBase) binary stream
+    :param chunk_size: (int) number of bytes read at once
+    :return: (generator) blocks of complete lines (bytes), the last line gets a newline if it had none
+    """
+    partial = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        cut = chunk.rfind(b"\n") + 1
+        if cut == 0:
+            partial += chunk
+            continue
+        yield partial + chunk[:cut]
+        partial = chunk[cut:]
+    if partial:
+        yield partial + b"\n"
+
+
+class Tailer:
+    """follows a log file across rotations and truncations and returns newly appended complete lines as bytes"""
+
+    def __init__(self, path, from_end=True, chunk_size=CHUNK_SIZE):
+        self.path = str(path)
+        self.chunk_size = chunk_size
+        self.rotations = 0  # number of rotations detected - for monitoring purposes
+        self.truncations = 0  # number of truncations detected
+        self._file = None  # unbuffered binary handle, kept open between reads
+        self._identity = None  # (st_dev, st_ino) of the opened file
+        self._read_pos = 0  # position of the handle in the opened file
+        self._partial = b""  # bytes read after the last newline: incomplete line
+        self._fingerprint = None  # fingerprint of the opened file, once it is FINGERPRINT_SIZE bytes long
+        self._pending = []  # (segment path, offset) rotated segments to read before the opened file
+        self._from_end = from_end  # used for 1st open, to go to end of file and disregard log file content
+
+    @property
+    def pos_in_file(self):
+        """
+        :return: (int) offset of the first byte that has not been returned as part of a complete line
+        """
+        return self._read_pos - len(self._partial)
+
+    @property
+    def identity(self):
+        """
+        :return: (tuple) (st_dev, st_ino) of the file currently followed, None if it has not been opened yet
+        """
+        return self._identity
+
+    @property
+    def fingerprint(self):
+        """
+        :return: (tuple) fingerprint of the beginning of the file currently followed, cf segments.fingerprint, None if
+                 it has not been opened yet
+        """
+        if self._fingerprint is not None or self._file is None:
+            return self._fingerprint
+        return self._read_fingerprint()
+
+    def _read_fingerprint(self):
+        """
+        Fingerprints the beginning of the opened file, the fingerprint is kept once the file is long enough for its
+        beginning not to change anymore
+        :return: (tuple) fingerprint, cf segments.fingerprint
+        """
+        self._file.seek(0)
+        data = self._file.read(sg.FINGERPRINT_SIZE)
+        self._file.seek(self._read_pos)
+        if len(data) == sg.FINGERPRINT_SIZE:
+            self._fingerprint = sg.fingerprint(data)
+        return sg.fingerprint(data)
+
+    def _open(self, position=None):
+        """
+        Opens self.path and goes to the given position (end of file if None)
+        :param position: (int) offset where to start reading
+        :return: (bool) True if the file could be opened
+        """
+        try:
+            new_file = open(self.path, 'rb', buffering=0)
+        except OSError:
+            return False
+        self.close()
+        self._file = new_file
+        stat = os.fstat(self._file.fileno())
+        self._identity = (stat.st_dev, stat.st_ino)
+        if position is None:
+            position = stat.st_size
+        self._read_pos = self._file.seek(position)
+        self._partial = b""
+        self._fingerprint = None
+        if self._read_pos >= sg.FINGERPRINT_SIZE:
+            self._read_fingerprint()
+        return True
+
+    def close(self):
+        """
+        Closes the followed file handle
+        :return: None
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _path_identity(self):
+        """
+        :return: (tuple) (st_dev, st_ino) of the file currently at self.path, None if there is none
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _check_truncation(self):
+        """
+        Goes back to the beginning of the file if it has been truncated below our position (copytruncate rotation)
+        :return: None
+        """
+        if os.fstat(self._file.fileno()).st_size < self._read_pos:
+            self.truncations += 1
+            if self._fingerprint is not None:  # copied to a rotated segment before truncation: read its remainder
+                self._pending = sg.find_unread(self.path, self._fingerprint, self.pos_in_file) or []
+            self._read_pos = self._file.seek(0)
+            self._partial = b""
+            self._fingerprint = None
+
+    def _drain(self):
+        """
+        Reads the opened file up to its current end
+        :return: (generator) blocks of complete lines, about chunk_size bytes each
+        """
+        while True:
+            chunk = self._file.read(self.chunk_size)
+            if not chunk:
+                return
+            self._read_pos += len(chunk)
+            if self._fingerprint is None and self._read_pos >= sg.FINGERPRINT_SIZE:
+                self._read_fingerprint()  # while the beginning of the file is there: it's gone after a truncation
+            cut = chunk.rfind(b"\n") + 1
+            if cut == 0:  # no line end in this chunk, everything is carried over
+                self._partial += chunk
+                continue
+            block = self._partial + chunk[:cut]
+            self._partial = chunk[cut:]
+            yield block
+
+    def _read_pending(self):
+        """
+        Reads the rotated segments left to read, from their saved offset to their end
+        :return: (generator) blocks of complete lines, about chunk_size bytes each
+        """
+        while self._pending:
+            path, position = self._pending.pop(0)
+            try:
+                segment = sg.open_segment(path)
+            except OSError:  # removed in the meantime: its lines are lost
+                continue
+            with segment:
+                segment.seek(position)  # gzip: decompresses and discards up to position, chunk by chunk
+                yield from read_stream_chunks(segment, self.chunk_size)
+
+    def unread_range(self):
+        """
+        :return: (tuple) (start, end) byte range of the followed file that has not been read yet, None if the file is
+                 not opened yet, has been rotated or truncated, or if rotated segments have to be read first
+                 (read_chunks handles these)
+        """
+        if self._file is None or self._pending or self._path_identity() != self._identity:
+            return None
+        size = os.fstat(self._file.fileno()).st_size
+        if size < self._read_pos:
+            return None
+        return self.pos_in_file, size
+
+    def resume(self, identity, position, fingerprint=None):
+        """
+        Starts following the file from a saved position instead of its end, provided it is still the same file. If
+        it has been rotated since, its remainder is read from its rotated segment, followed by the segments rotated
+        after it and the new file from its beginning
+        :param identity: (tuple) (st_dev, st_ino) of the file when the position was saved
+        :param position: (int) offset of the first byte that had not been read
+        :param fingerprint: (tuple) fingerprint of the file when the position was saved - optional
+        :return: (bool) True if reading resumes at position, False if the file can't be found and the end of the
+                 current one will be used
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            stat = None
+        same_file = stat is not None and (stat.st_dev, stat.st_ino) == tuple(identity) and stat.st_size >= position
+        if same_file and fingerprint is not None:  # truncated, then written again beyond position
+            same_file = sg.segment_fingerprint(self.path, fingerprint[0]) == tuple(fingerprint)
+        if same_file:
+            if not self._open(position):
+                return False
+            self._from_end = False
+            return True
+        pending = sg.find_unread(self.path, fingerprint, position) if fingerprint is not None else None
+        if pending is None:
+            return False
+        self._pending = pending
+        self._from_end = False  # the live file is new: it is read from its beginning
+        return True
+
+    def skip_to(self, position):
+        """
+        Goes to a given position: bytes before it are considered read, e.g. by other processes
+        :param position: (int) offset of the beginning of a line
+        :return: None
+        """
+        self._read_pos = self._file.seek(position)
+        self._partial = b""
+
+    def read_chunks(self):
+        """
+        Reads everything appended since last call. If the file has been rotated, the remainder of the old file is
+        read before switching to the new one.
+        :return: (generator) blocks of complete lines (bytes), each line ending with a newline
+        """
+        if self._file is None:
+            yield from self._read_pending()
+            position = None if self._from_end else 0
+            if not self._open(position):
+                self._from_end = False  # not there at startup: its lines will all be new once it is created
+                return
+            self._from_end = False
+        else:
+            self._check_truncation()
+            yield from self._read_pending()
+        yield from self._drain()
+        identity = self._path_identity()
+        if identity is not None and identity != self._identity:  # rotated: old file is complete, follow the new one
+            self.rotations += 1
+            if self._partial:  # last line of the old file had no newline: it will never be completed
+                yield self._partial + b"\n"
+            self._open(0)
+            yield from self._drain()
+
+    def read(self):
+        """
+        Reads everything appended since last call
+        :return: (bytes) complete lines, b"" if there is nothing new
+        """
+        return b"".join(self.read_chunks())
@@ -49,4 +49,48 @@ class AlertTest(unittest.TestCase):
             self.datastruct.hist_traffic.append(100)
         on_alert, alert_info = self.datastruct.compute_alert(20, False)
         self.assertFalse(on_alert)
-        self.assertEqual(alert_info["status_code"], 2)
\ No newline at end of file
+        self.assertEqual(alert_info["status_code"], 2)
+
+
+class EventTimeAlertTest(unittest.TestCase):
+    """
+    test case for event-time alerting logic: 1 hit/s over a 10s window, 2s of lateness
+    """
+    def setUp(self):
+        self.datastruct = dt.Datastruct(10, 5, event_time=True, lateness=2)
+        self.window = self.datastruct.window
+
+    def test_exact_second(self):
+        """
+        Tests that alert and recovery are raised at the exact second the average crosses the treshold
+        """
+        for second in range(100, 110):
+            self.window.add(second, 20)  # 20 hits/s during 10s
+        self.window.advance(130)  # then nothing
+        on_alert, transitions = self.datastruct.compute_alerts(10, False)
+        self.assertFalse(on_alert)
+        self.assertEqual([(info["status_code"], info["time"]) for info in transitions], [(1, 104), (0, 115)])
+
+    def test_out_of_order(self):
+        """
+        Tests that hits up to lateness seconds late are counted and older ones are dropped
+        """
+        self.window.add(100, 5)
+        self.window.add(102, 5)
+        self.window.add(101, 5)  # late but within lateness
+        self.window.add(99, 5)  # older than watermark
+        self.window.advance(110)
+        self.assertEqual(self.window.total, 15)
+        self.assertEqual(self.window.late_hits, 5)
+
+    def test_running_sum(self):
+        """
+        Tests that the running sum only covers the window length
+        """
+        for second in range(100, 200):
+            self.window.add(second, second)
+        self.window.advance(1000)  # long gap: window is emptied
+        self.assertEqual(self.window.total, 0)
+        self.window.add(1000, 3)
+        self.window.advance(1003)  # 1000 is closed once lateness has elapsed
+        self.assertEqual(self.datastruct.compute_debit(), 0.3)
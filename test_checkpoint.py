@@ -0,0 +1,107 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import checkpoint as cp
+import multilog as ml
+import rules as rl
+
+LINE = '127.0.0.1 - frank [10/Oct/2000:13:55:{second:02d} +0000] "GET /fruits/image.jpg HTTP/1.0" 200 100\n'
+
+
+class CheckpointTest(unittest.TestCase):
+    """
+    test case for saving and resuming the position in log files and the alert state
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "access.log")
+        self.checkpoint_path = os.path.join(self.directory, "monitor.ckpt")
+        open(self.path, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, seconds, hits):
+        with open(self.path, "a") as f:
+            for second in seconds:
+                f.write(LINE.format(second=second) * hits)
+
+    def _run_until_alert(self):
+        """
+        :return: (MultiLog) monitor on alert, whose state has been saved
+        """
+        logs = ml.MultiLog([self.path], 10, 1, event_time=True, lateness=0)
+        logs.fill()
+        self._write(range(12), 5)  # 5 hits/s for 12s: window of 10s is full
+        logs.fill()
+        alerts = logs.compute_alerts(4, 4)
+        self.assertEqual(alerts[0][1]["status_code"], 1)
+        cp.save(self.checkpoint_path, logs.get_state())
+        return logs
+
+    def test_resume(self):
+        """
+        Tests that lines written while the monitor was stopped are read once and that the alert goes on
+        """
+        before = self._run_until_alert()
+        self._write(range(12, 14), 1)  # written while stopped: traffic drops
+        logs = ml.MultiLog([self.path], 10, 1, event_time=True, lateness=0)
+        self.assertEqual(logs.resume(cp.load(self.checkpoint_path)), [self.path])
+        self.assertEqual(logs.merged.window.total, before.merged.window.total)
+        logs.fill()
+        self.assertEqual(logs.merged.last_hits, 2)
+        alerts = logs.compute_alerts(4, 4)  # still on alert: no new trigger, 2 seconds closed at 1 hit/s
+        self.assertEqual(alerts, [])
+        self._write(range(14, 30), 1)
+        logs.fill()
+        self.assertEqual([info["status_code"] for _, info in logs.compute_alerts(4, 4)], [0])
+
+    def test_other_window(self):
+        """
+        Tests that the alert window saved is ignored by a monitor with another lateness, reading still resumes
+        """
+        self._run_until_alert()
+        logs = ml.MultiLog([self.path], 10, 1, event_time=True, lateness=2)
+        self.assertEqual(logs.resume(cp.load(self.checkpoint_path)), [self.path])
+        self.assertEqual(logs.merged.window.total, 0)
+
+    def test_rules(self):
+        """
+        Tests that alert rules go on from the hits and states saved
+        """
+        rules = rl.parse_rules(["user_hits frank 4"])
+        logs = ml.MultiLog([self.path], 10, 1, rules=rules, event_time=True, lateness=0)
+        logs.fill()
+        self._write(range(12), 5)
+        logs.fill()
+        self.assertEqual([name for name, _ in logs.compute_alerts(10, 10)], ["user_hits frank"])
+        cp.save(self.checkpoint_path, logs.get_state())
+        resumed = ml.MultiLog([self.path], 10, 1, rules=rules, event_time=True, lateness=0)
+        resumed.resume(cp.load(self.checkpoint_path))
+        self.assertEqual(resumed.merged.rules.get_state(), logs.merged.rules.get_state())
+        self._write(range(12, 30), 1)
+        resumed.fill()
+        self.assertEqual([(name, info["status_code"]) for name, info in resumed.compute_alerts(10, 10)],
+                         [("user_hits frank", 0)])
+
+    def test_rotated_or_corrupt(self):
+        """
+        Tests that the remainder of a log file rotated and compressed while stopped is read before the new log file,
+        and that a corrupt checkpoint is ignored
+        """
+        self._run_until_alert()
+        self._write(range(12, 14), 1)  # written while stopped, before rotation
+        with open(self.path, "rb") as f, gzip.open(self.path + ".1.gz", "wb") as segment:
+            segment.write(f.read())
+        os.remove(self.path)
+        self._write(range(14, 15), 1)
+        logs = ml.MultiLog([self.path], 10, 1, event_time=True, lateness=0)
+        self.assertEqual(logs.resume(cp.load(self.checkpoint_path)), [self.path])
+        logs.fill()
+        self.assertEqual(logs.merged.last_hits, 3)
+        with open(self.checkpoint_path, "r+b") as f:
+            f.seek(10)
+            f.write(b"\xff")
+        self.assertIsNone(cp.load(self.checkpoint_path))
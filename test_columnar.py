@@ -0,0 +1,58 @@
+import unittest
+import columnar as cl
+import regex_parser as rp
+
+LINE = '127.0.0.1 - {user} [10/Oct/2000:13:55:{second:02d} +0000] "{method} /{section}/a.jpg HTTP/1.0" {status} 100\n'
+
+
+class RequestStoreTest(unittest.TestCase):
+    """
+    test case for sub-window queries over the columnar store of recent requests
+    """
+    def setUp(self):
+        self.store = cl.RequestStore(capacity=8)
+        lines = [LINE.format(user=user, second=second, method=method, section=section, status=status)
+                 for second, user, method, section, status in [(0, "frank", "GET", "fruits", 200),
+                                                               (1, "frank", "GET", "fruits", 404),
+                                                               (2, "remi", "POST", "vegetables", 500),
+                                                               (3, "frank", "GET", "vegetables", 500)]]
+        self.batch = rp.parse_batch("".join(lines))
+        self.start = self.batch.seconds[0]
+        self.store.add_batch(self.batch)
+
+    def test_queries(self):
+        """
+        Tests grouping, filters and time bounds
+        """
+        self.assertEqual(self.store.count("section"), {"fruits": 2, "vegetables": 2})
+        self.assertEqual(self.store.count("section", errors=True, user="frank"), {"fruits": 1, "vegetables": 1})
+        self.assertEqual(self.store.count("user", start=self.start + 1, end=self.start + 3), {"frank": 1, "remi": 1})
+        self.assertEqual(self.store.count(method="POST"), 1)
+        self.assertEqual(self.store.count("status", section="vegetables"), {500: 2})
+        self.assertEqual(self.store.count(user="nobody"), 0)
+        self.assertEqual(self.store.traffic(user="frank"), 300)
+        self.assertRaises(ValueError, self.store.count, "size")
+
+    def test_bounded(self):
+        """
+        Tests that the oldest requests are overwritten once the store is full
+        """
+        for _ in range(2):
+            self.store.add_batch(rp.slice_batch(self.batch, 1))  # 4 + 3 + 3 requests in 8 rows
+        self.assertEqual(self.store.size, 8)
+        self.assertEqual(self.store.count(), 8)
+        self.assertEqual(self.store.count("status"), {404: 2, 500: 6})
+        self.assertEqual(self.store.time_range(), (self.start + 1, self.start + 3))
+
+    def test_compaction(self):
+        """
+        Tests that values of overwritten requests are forgotten, so that memory doesn't grow with new users
+        """
+        for user in range(cl.COMPACTION_SIZE * 3):
+            self.store.add_batch(rp.parse_batch(LINE.format(user="user{}".format(user), second=5, method="GET",
+                                                            section="fruits", status=200)))
+        self.assertLessEqual(len(self.store._values["user"]), cl.COMPACTION_SIZE + 1)
+        last = "user{}".format(cl.COMPACTION_SIZE * 3 - 1)
+        self.assertEqual(self.store.count("user", user=last), {last: 1})
+        self.assertEqual(sum(self.store.count("user").values()), 8)
+        self.assertEqual(self.store.count(user="user0"), 0)
@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+import endpoint as ep
+import multilog as ml
+
+LINE = '127.0.0.1 - frank [10/Oct/2000:13:55:{second:02d} +0000] "GET /fruits/image.jpg HTTP/1.0" 200 100\n'
+
+
+class EndpointTest(unittest.TestCase):
+    """
+    test case for serving snapshots to local scrapers
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "access.log")
+        open(self.path, "w").close()
+        self.publisher = ep.SnapshotPublisher()
+        self.server = ep.start_server("127.0.0.1:0", self.publisher)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def tearDown(self):
+        ep.stop_server(self.server)
+        shutil.rmtree(self.directory)
+
+    def _get(self, path):
+        with urllib.request.urlopen(self.url + path) as response:
+            return response.headers["Content-Type"], response.read().decode()
+
+    def _end_period(self, logs):
+        snapshot = logs.snapshot()
+        logs.clear_last()
+        snapshot["alerts"] = logs.compute_alerts(4, 4)
+        history = logs.merged.history
+        self.publisher.publish(snapshot, logs.alert_states(), history.copy() if history is not None else None)
+
+    def test_snapshot(self):
+        """
+        Tests that the JSON and Prometheus snapshots show the last period, the debit and the alert history
+        """
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self._get("/")
+        self.assertEqual(context.exception.code, 503)  # nothing published yet
+        logs = ml.MultiLog([self.path], 10, 1, event_time=True, lateness=0)
+        logs.fill()
+        with open(self.path, "a") as f:
+            for second in range(12):
+                f.write(LINE.format(second=second) * 5)
+        logs.fill()
+        self._end_period(logs)
+        content_type, body = self._get("/")
+        self.assertEqual(content_type, ep.JSON_TYPE)
+        record = json.loads(body)
+        self.assertEqual(record["last_hits"], 60)
+        self.assertEqual(record["top_sections"], [["fruits", 60]])
+        self.assertEqual(record["alert_states"], {"merged": True})
+        self.assertEqual([alert["status_code"] for alert in record["alert_history"]], [1])
+        content_type, body = self._get("/metrics")
+        self.assertEqual(content_type, ep.PROMETHEUS_TYPE)
+        self.assertIn("http_monitor_hits 60\n", body)
+        self.assertIn("http_monitor_debit {}\n".format(record["debit"]), body)
+        self.assertIn('http_monitor_section_hits{section="fruits"} 60\n', body)
+        self.assertIn('http_monitor_on_alert{source="merged"} 1\n', body)
+        self._end_period(logs)  # no traffic: the alert history is kept, the last period is replaced
+        record = json.loads(self._get("/snapshot")[1])
+        self.assertEqual((record["last_hits"], len(record["alert_history"])), (0, 1))
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self._get("/unknown")
+        self.assertEqual(context.exception.code, 404)
+
+    def test_history(self):
+        """
+        Tests that history queries are answered from the copy of the requests kept published with the last period
+        """
+        logs = ml.MultiLog([self.path], 10, 1, event_time=True, lateness=0, history=100)
+        logs.fill()
+        with open(self.path, "a") as f:
+            for second in range(12):
+                f.write(LINE.format(second=second).replace("frank", "remi" if second < 6 else "frank"))
+        logs.fill()
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self._get("/history")
+        self.assertEqual(context.exception.code, 503)  # nothing published yet
+        self._end_period(logs)
+        with open(self.path, "a") as f:
+            f.write(LINE.format(second=12))  # not in the copy published
+        logs.fill()
+        self.assertEqual(json.loads(self._get("/history")[1])["hits"], 12)
+        record = json.loads(self._get("/history?group_by=user&last=4")[1])
+        self.assertEqual((record["hits"], record["counts"]), (4, [["frank", 4]]))
+        self.assertEqual(json.loads(self._get("/history?user=remi")[1])["traffic"], 600)
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self._get("/history?group_by=size")
+        self.assertEqual(context.exception.code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
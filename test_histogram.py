@@ -0,0 +1,53 @@
+import random
+import unittest
+import histogram as hg
+
+
+class LogHistogramTest(unittest.TestCase):
+    """
+    test case for bounded-memory size histograms
+    """
+    def test_percentiles_error_bound(self):
+        """
+        Tests that percentiles are within the relative error of the exact ones
+        """
+        rng = random.Random(0)
+        values = sorted(int(rng.lognormvariate(8, 2)) for _ in range(10000))
+        histogram = hg.LogHistogram()
+        for value in values:
+            histogram.add(value)
+        for percent in hg.PERCENTILES:
+            exact = values[len(values) * percent // 100 - 1]
+            self.assertLessEqual(abs(histogram.percentile(percent) - exact), exact / 16.0 + 1)
+
+    def test_merge(self):
+        """
+        Tests that merging histograms is the same as recording every value in one
+        """
+        first, second, both = hg.LogHistogram(), hg.LogHistogram(), hg.LogHistogram()
+        first.add_indexes(hg.bucket_indexes(range(0, 5000, 7)))
+        second.add_indexes(hg.bucket_indexes(range(100000, 200000, 13)))
+        both.add_indexes(hg.bucket_indexes(list(range(0, 5000, 7)) + list(range(100000, 200000, 13))))
+        first.merge(second)
+        self.assertEqual(first.percentiles(), both.percentiles())
+        self.assertEqual(first.count, both.count)
+
+    def test_keyed_overflow(self):
+        """
+        Tests that keys beyond max_keys share the OTHER histogram
+        """
+        keyed = hg.KeyedHistograms(max_keys=2)
+        keyed.add_indexes(["a", "b", "c", "d"], hg.bucket_indexes([1, 2, 3, 4]))
+        self.assertEqual(keyed.percentiles("a")["p50"], 1)
+        self.assertEqual(keyed.percentiles(hg.OTHER)["p99"], 4)
+        self.assertIsNone(keyed.percentiles("c")["p50"])
+
+    def test_keyed_maximum(self):
+        """
+        Tests that percentiles of a key are capped by its largest value, not by the upper bound of its bucket
+        """
+        keyed = hg.KeyedHistograms()
+        sizes = [731, 10000, 10000, 12]
+        keyed.add_indexes(["a", "b", "b", "a"], hg.bucket_indexes(sizes), sizes)
+        self.assertEqual(keyed.percentiles("a")["p99"], 731)
+        self.assertEqual(keyed.percentiles("b")["p99"], 10000)
@@ -0,0 +1,21 @@
+import unittest
+import ingest as ig
+
+
+class PublishTest(unittest.TestCase):
+    """
+    test case for snapshot hand-over when the display falls behind
+    """
+    def test_drop_keeps_alerts(self):
+        """
+        Tests that a full queue drops the oldest statistics, counts them and keeps their alerts in time order
+        """
+        worker = ig.IngestWorker(None, 10, 20, 20, queue_size=2)
+        for counter in range(4):
+            worker._publish({"counter": counter, "alerts": [(None, {"counter": counter})]})
+        snapshots = worker.get_snapshots()
+        self.assertEqual(worker.dropped_snapshots, 2)
+        self.assertEqual([snapshot["counter"] for snapshot in snapshots], [2, 3])
+        self.assertEqual([info["counter"] for _, info in snapshots[0]["alerts"]], [0, 1, 2])
+        self.assertEqual([info["counter"] for _, info in snapshots[1]["alerts"]], [3])
+        self.assertEqual(worker.get_snapshots(), [])
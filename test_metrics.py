@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+import metrics as mt
+import multilog as ml
+
+LINE = '127.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] "GET /fruits/image.jpg HTTP/1.0" 200 100\n'
+
+
+class MetricsTest(unittest.TestCase):
+    """
+    test case for self-instrumentation counters and stage timers
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "access.log")
+        open(self.path, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fill_metrics(self):
+        """
+        Tests that lines, bytes, malformed lines, bytes behind and stages are counted per period
+        """
+        logs = ml.MultiLog([self.path], 120, 10)
+        logs.fill()
+        logs.metrics.snapshot()
+        with open(self.path, "a") as f:
+            f.write(LINE * 3 + "not a log line\n")
+        self.assertEqual(logs.bytes_behind(), 3 * len(LINE) + 15)
+        logs.fill()
+        self.assertEqual(logs.bytes_behind(), 0)
+        snapshot = logs.metrics.snapshot()
+        self.assertEqual((snapshot["lines"], snapshot["malformed_lines"]), (4, 1))
+        self.assertEqual(snapshot["bytes"], 3 * len(LINE) + 15)
+        self.assertEqual(snapshot["stages"]["parse"]["calls"], 1)
+        self.assertEqual(snapshot["stages"]["tail"]["calls"], 2)  # last call finds nothing new
+        self.assertEqual(logs.metrics.snapshot()["stages"]["parse"]["calls"], 0)  # per period
+
+    def test_dump(self):
+        """
+        Tests that a dump appends one JSON line
+        """
+        path = os.path.join(self.directory, "metrics.jsonl")
+        for _ in range(2):
+            mt.dump(mt.Metrics().snapshot(), path)
+        with open(path) as f:
+            self.assertEqual(len(f.readlines()), 2)
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+import multilog as ml
+
+LINE = '127.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] "GET /{section}/image.jpg HTTP/1.0" 200 100\n'
+
+
+class MultiLogTest(unittest.TestCase):
+    """
+    test case for per-source and merged statistics over several log files
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.directory, name) for name in ("a.log", "b.log")]
+        for path in self.paths:
+            open(path, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_merged_and_per_source(self):
+        """
+        Tests that each source only counts its own lines and that the merged view counts them all
+        """
+        paths = ml.expand_paths([os.path.join(self.directory, "*.log")])
+        self.assertEqual(paths, self.paths)
+        logs = ml.MultiLog(paths, 120, 10)
+        logs.fill()  # 1st fill goes to the end of the files
+        with open(self.paths[0], "a") as f:
+            f.write(LINE.format(section="fruits") * 2)
+        with open(self.paths[1], "a") as f:
+            f.write(LINE.format(section="vegetables") * 3)
+        logs.fill()
+        self.assertEqual(list(logs.source_hits().values()), [2, 3])
+        self.assertEqual(logs.merged.compute_stats()["top_sections"], [("vegetables", 3), ("fruits", 2)])
+
+    def test_source_behind(self):
+        """
+        Tests that the hits of a source behind the others in event time are counted in the merged alert window
+        """
+        logs = ml.MultiLog(self.paths, 10, 1, event_time=True, lateness=0)
+        logs.fill()
+        line = '127.0.0.1 - frank [10/Oct/2000:13:55:{:02d} +0000] "GET /fruits/image.jpg HTTP/1.0" 200 100\n'
+        with open(self.paths[0], "a") as f:
+            f.write("".join(line.format(20 + second) * 10 for second in range(30)))
+        with open(self.paths[1], "a") as f:
+            f.write("".join(line.format(second) * 10 for second in range(30)))  # 20s behind a.log
+        logs.fill()
+        self.assertEqual(logs.merged.window.late_hits, 0)
+        self.assertEqual(logs.merged.window.watermark, logs.sources[self.paths[1]].window.watermark)
+        self.assertEqual(logs.merged.window.total, 190)  # ]13:55:18, 13:55:28]: 10s of b, 9s of a (from 13:55:20)
@@ -0,0 +1,28 @@
+import unittest
+import regex_parser as rp
+
+LINE = '127.0.0.1 user-identifier frank [10/Oct/2000:13:55:36 -0700] "GET /test/image.jpg HTTP/1.0" 200 2326'
+
+
+class ParseBatchTest(unittest.TestCase):
+    """
+    test case for batch parsing
+    """
+    def test_same_fields_as_parse(self):
+        """
+        Tests that parse_batch extracts the same fields as parse
+        """
+        parsed = rp.parse(LINE)
+        batch = rp.parse_batch(LINE.encode() + b"\n")
+        self.assertEqual(batch.userids, [parsed["userid"]])
+        self.assertEqual(batch.sections, [parsed["section"]])
+        self.assertEqual(batch.statuses, [parsed["status"]])
+        self.assertEqual(batch.sizes, [parsed["size"]])
+
+    def test_malformed_lines(self):
+        """
+        Tests that malformed lines are counted and skipped
+        """
+        batch = rp.parse_batch(["not a log line", LINE, "", LINE])
+        self.assertEqual(batch.malformed, 2)
+        self.assertEqual(batch.userids, ["frank", "frank"])
@@ -0,0 +1,58 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import replay as rp
+import rules as rl
+
+LINE = '127.0.0.1 - frank [10/Oct/2000:13:55:{second:02d} +0000] "GET /fruits/kiwi.jpg HTTP/1.0" 200 100\n'
+
+
+class ReplayTest(unittest.TestCase):
+    """
+    test case for offline replay on the log timestamps clock
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_periods_and_alerts(self):
+        """
+        Tests that periods are cut on timestamps and that alerts are raised at the second they happen
+        """
+        chunk = "".join(LINE.format(second=second) * (5 if second < 10 else 1) for second in range(30))
+        output = io.StringIO()
+        replayer = rp.Replayer(10, 10, 3, output, lateness=0)
+        replayer.feed(chunk.encode())
+        replayer.finish()
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([record["last_hits"] for record in records if record["type"] == "stats"], [50, 10, 10])
+        self.assertEqual([record["debit"] for record in records if record["type"] == "stats"], [5.0, 1.0, 1.0])
+        alerts = [(record["status_code"], record["time"] % 60) for record in records if record["type"] == "alert"]
+        self.assertEqual(alerts, [(1, 5), (0, 15)])
+
+    def test_several_log_files(self):
+        """
+        Tests that the lines of several log files are merged in timestamp order, none being dropped as late, and that
+        each log file and each rule has its own alerts
+        """
+        paths = [os.path.join(self.directory, name) for name in ("a.log", "b.log")]
+        for path, hits in zip(paths, (lambda second: 2, lambda second: 5 if second < 10 else 0)):
+            with open(path, "w") as f:
+                f.write("".join(LINE.format(second=second) * hits(second) for second in range(30)))
+        output = io.StringIO()
+        rules = rl.parse_rules(["section_hits fruits 6"])
+        replayer = rp.replay(paths, 10, 10, 3, output, rules=rules, lateness=0)  # merged treshold: 2 * 3 hits/s
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        stats = [record for record in records if record["type"] == "stats"]
+        self.assertEqual([record["last_hits"] for record in stats], [70, 20, 20])
+        self.assertEqual(stats[0]["source_hits"], {paths[0]: 20, paths[1]: 50})
+        self.assertEqual(replayer.datastruct.window.late_hits, 0)
+        alerts = [(record.get("source"), record["status_code"]) for record in records if record["type"] == "alert"]
+        self.assertEqual(sorted(alerts, key=str), sorted([(None, 1), (None, 0), (paths[1], 1), (paths[1], 0),
+                                                          ("section_hits fruits", 1), ("section_hits fruits", 0)],
+                                                         key=str))
@@ -0,0 +1,85 @@
+import unittest
+import regex_parser as rp
+import rules as rl
+
+LINE = '127.0.0.1 - {user} [10/Oct/2000:13:55:36 +0000] "GET /{section}/a.jpg HTTP/1.0" {status} 100\n'
+
+
+class RuleEngineTest(unittest.TestCase):
+    """
+    test case for per-section and per-user alert rules
+    """
+    def setUp(self):
+        rules = rl.parse_rules(["# kind key threshold", "section_hits fruits 2", "section_5xx * 50",
+                                "user_hits frank 1  # hits/s"])
+        self.engine = rl.RuleEngine(rules, 20, 10)  # alert period of 2 periods
+
+    def _period(self, lines):
+        self.engine.add_batch(rp.parse_batch("".join(LINE.format(user=user, section=section, status=status)
+                                                     for user, section, status in lines)))
+        return sorted((name, info["status_code"], info["debit"]) for name, info in self.engine.tick())
+
+    def test_triggers_and_recoveries(self):
+        """
+        Tests that each rule has its own state, that wildcard rules apply to new keys and that recoveries happen
+        once hits leave the alert period
+        """
+        alerts = self._period([("frank", "fruits", 200)] * 40 + [("remi", "others", 500)] * 10)
+        self.assertEqual(alerts, [("section_5xx others", 1, 100), ("section_hits fruits", 1, 2),
+                                  ("user_hits frank", 1, 2)])
+        alerts = self._period([("remi", "others", 200)] * 10)  # others: 10 5xx out of 20 hits, still 50%
+        self.assertEqual(alerts, [])
+        alerts = self._period([])  # 1st period leaves the alert period
+        self.assertEqual(alerts, [("section_5xx others", 0, 0), ("section_hits fruits", 0, 0),
+                                  ("user_hits frank", 0, 0)])
+
+    def test_bad_rule(self):
+        """
+        Tests that malformed rules are reported with their line number
+        """
+        self.assertRaises(ValueError, rl.parse_rules, ["section_hits fruits"])
+        self.assertRaises(ValueError, rl.parse_rules, ["", "status_hits 500 2"])
+
+    def test_idle_keys_dropped(self):
+        """
+        Tests that wildcard rules of idle keys are dropped once out of the alert period, explicit rules are kept
+        """
+        rule_set = self.engine.rule_sets["user_hits"]
+        rule_set.add(rl.WILDCARD, 100)
+        self._period([("user{}".format(user), "fruits", 200) for user in range(100)] + [("frank", "fruits", 200)])
+        self.assertEqual(len(rule_set.keys), 101)
+        self._period([("remi", "fruits", 200)])
+        self._period([("remi", "fruits", 200)])  # user0...user99 idle over the alert period: dropped on next tick
+        self._period([])
+        self.assertEqual(rule_set.keys, ["frank", "remi"])
+        self._period([])
+        self._period([])
+        self.assertEqual(rule_set.keys, ["frank"])
+
+    def test_event_time(self):
+        """
+        Tests that a period only takes the hits of the seconds closed by the watermark, and that late hits are dropped
+        """
+        lines = [LINE.format(user="frank", section="fruits", status=200).replace(":36 ", ":{:02d} ".format(second))
+                 for second in (36, 36, 41)]
+        batch = rp.parse_batch("".join(lines))
+        self.engine.add_batch(batch)
+        watermark = batch.seconds[0]
+        self.assertEqual(self.engine.tick(watermark), [])  # 2 hits over 20s: frank below 1 hit/s
+        self.engine.add_batch(rp.parse_batch(lines[0] * 5 + lines[2] * 17))  # 2nd 36: late, 41: next period
+        alerts = self.engine.tick(watermark + 5)
+        self.assertEqual([(name, info["debit"], info["time"]) for name, info in alerts],
+                         [("user_hits frank", 1, watermark + 5)])  # 2 + 1 + 17 hits over 20s
+        self.assertEqual(self.engine.dropped_hits, 5)
+
+    def test_backlog(self):
+        """
+        Tests that a backlog read at once only counts the hits of its last alert period
+        """
+        engine = rl.RuleEngine(rl.parse_rules(["user_hits frank 5"]), 120, 10)
+        lines = "".join(LINE.format(user="frank", section="fruits", status=200).replace(
+            "13:55:36", "13:{:02d}:{:02d}".format(second // 60, second % 60)) for second in range(3600))
+        batch = rp.parse_batch(lines)  # 1 hit/s over an hour
+        engine.add_batch(batch)
+        self.assertEqual(engine.tick(max(batch.seconds)), [])
+        self.assertEqual(list(engine.rule_sets["user_hits"].hits), [120])
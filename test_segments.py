@@ -0,0 +1,29 @@
+import os
+import shutil
+import tempfile
+import unittest
+import segments as sg
+
+
+class SegmentsTest(unittest.TestCase):
+    """
+    test case for rotated segments lookup and ordering
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "access.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_order(self):
+        """
+        Tests that segments are listed most recent first and replayed oldest first
+        """
+        for name in ("access.log", "access.log.1", "access.log.1.gz", "access.log.2.gz", "access.log.10.gz",
+                     "access.log.old"):
+            open(os.path.join(self.directory, name), "w").close()
+        segments = sg.rotated_segments(self.path)
+        self.assertEqual([os.path.basename(segment) for segment in segments],
+                         ["access.log.1", "access.log.2.gz", "access.log.10.gz"])
+        self.assertEqual(sg.chronological([self.path] + segments), segments[::-1] + [self.path])
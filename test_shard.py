@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+import datastruct as dt
+import shard as sh
+
+
+class ShardTest(unittest.TestCase):
+    """
+    test case for parallel catch-up on a large backlog
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "access.log")
+        with open("logs2.txt", "rb") as f:
+            self.lines = f.read()
+        self.min_shard_size = sh.MIN_SHARD_SIZE
+        sh.MIN_SHARD_SIZE = 1 << 12  # small shards so that the sample log is split
+
+    def tearDown(self):
+        sh.MIN_SHARD_SIZE = self.min_shard_size
+        shutil.rmtree(self.directory)
+
+    def test_shard_ranges(self):
+        """
+        Tests that shards are contiguous and start at the beginning of a line
+        """
+        with open(self.path, "wb") as f:
+            f.write(self.lines)
+        ranges = sh.shard_ranges(self.path, 0, len(self.lines), 8)
+        self.assertEqual(len(ranges), 8)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(self.lines))
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(self.lines[start - 1:start], b"\n")
+
+    def test_same_as_sequential(self):
+        """
+        Tests that a parallel catch-up gives the same statistics as a sequential one, and that a backlog whose lines
+        are kept in history is read sequentially
+        """
+        open(self.path, "wb").close()
+        sequential = dt.Datastruct(120, 10, event_time=True)
+        parallel = dt.Datastruct(120, 10, event_time=True, workers=2)
+        kept = dt.Datastruct(120, 10, event_time=True, workers=2, history=1 << 13)
+        parallel.CATCH_UP_SIZE = kept.CATCH_UP_SIZE = 1
+        for datastruct in (sequential, parallel, kept):
+            datastruct.fill(self.path)  # 1st fill goes to the end of the file
+        with open(self.path, "ab") as f:
+            f.write(self.lines + b"incomplete")
+        for datastruct in (sequential, parallel, kept):
+            datastruct.fill(self.path)
+        self.assertEqual(parallel.snapshot(), sequential.snapshot())
+        self.assertEqual(kept.history.size, sequential.snapshot()["last_hits"])
+        self.assertEqual(parallel.window.total, sequential.window.total)
+        self.assertEqual(parallel._pos_in_file, len(self.lines))
+
+    def test_rotated_during_catch_up(self):
+        """
+        Tests that workers give up on a log file that is not the followed one anymore
+        """
+        with open(self.path, "wb") as f:
+            f.write(self.lines)
+        stat = os.stat(self.path)
+        identity = (stat.st_dev, stat.st_ino)
+        self.assertIsNotNone(sh.aggregate_range(self.path, 0, len(self.lines), 2, identity))
+        os.rename(self.path, self.path + ".1")
+        with open(self.path, "wb") as f:
+            f.write(self.lines)  # same content, other file
+        self.assertIsNone(sh.aggregate_range(self.path, 0, len(self.lines), 2, identity))
@@ -0,0 +1,82 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import tailer as tl
+
+
+class TailerTest(unittest.TestCase):
+    """
+    test case for log file following across partial lines, rotations and truncations
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "access.log")
+        self._write("old line\n", "w")
+        self.tailer = tl.Tailer(self.path, chunk_size=8)  # small chunks so that lines span several reads
+
+    def tearDown(self):
+        self.tailer.close()
+        shutil.rmtree(self.directory)
+
+    def _write(self, text, mode="a"):
+        with open(self.path, mode) as f:
+            f.write(text)
+
+    def test_starts_at_end(self):
+        """
+        Tests that content written before the 1st read is disregarded, unless the file didn't exist yet
+        """
+        self.assertEqual(self.tailer.read(), b"")
+        self._write("new line\n")
+        self.assertEqual(self.tailer.read(), b"new line\n")
+        later = tl.Tailer(self.path + ".later")
+        self.assertEqual(later.read(), b"")
+        with open(later.path, "w") as f:
+            f.write("first line\n")
+        self.assertEqual(later.read(), b"first line\n")
+        later.close()
+
+    def test_partial_line(self):
+        """
+        Tests that an incomplete line is only returned once its newline has been written
+        """
+        self.tailer.read()
+        self._write("first line\nsecond")
+        self.assertEqual(self.tailer.read(), b"first line\n")
+        self._write(" half\n")
+        self.assertEqual(self.tailer.read(), b"second half\n")
+        self.assertEqual(self.tailer.pos_in_file, os.path.getsize(self.path))
+
+    def test_rotation(self):
+        """
+        Tests that the end of the rotated file is read before the new file, from its beginning
+        """
+        self.tailer.read()
+        self._write("before rotation\n")
+        os.rename(self.path, self.path + ".1")
+        self._write("after rotation\n", "w")
+        self.assertEqual(self.tailer.read(), b"before rotation\nafter rotation\n")
+        self.assertEqual(self.tailer.rotations, 1)
+
+    def test_truncation(self):
+        """
+        Tests that a truncated file is read again from its beginning
+        """
+        self.tailer.read()
+        self._write("x\n", "w")
+        self.assertEqual(self.tailer.read(), b"x\n")
+        self.assertEqual(self.tailer.truncations, 1)
+
+    def test_copytruncate_segment(self):
+        """
+        Tests that lines copied to a compressed segment before truncation are read before the truncated file
+        """
+        self._write("padding line\n" * 100)  # longer than the fingerprint
+        self.tailer.read()
+        self._write("before truncation\n")
+        with open(self.path, "rb") as f, gzip.open(self.path + ".1.gz", "wb") as segment:
+            segment.write(f.read())
+        self._write("after truncation\n", "w")
+        self.assertEqual(self.tailer.read(), b"before truncation\nafter truncation\n")
@@ -0,0 +1,36 @@
+import random
+import unittest
+from collections import Counter
+import topk
+
+
+class SpaceSavingTest(unittest.TestCase):
+    """
+    test case for bounded-memory heavy hitter tracking
+    """
+    def test_exact_under_capacity(self):
+        """
+        Tests that counts are exact while there are fewer keys than capacity
+        """
+        space_saving = topk.SpaceSaving(10)
+        keys = ["a"] * 5 + ["b"] * 3 + ["c"]
+        space_saving.update(keys)
+        self.assertEqual(space_saving.most_common(3), Counter(keys).most_common(3))
+
+    def test_error_bound(self):
+        """
+        Tests that heavy hitters are found in a long tail and that counts respect the N / capacity bound
+        """
+        rng = random.Random(42)
+        keys = ["hot"] * 2000 + ["warm"] * 1000 + ["user{}".format(rng.randint(0, 50000)) for _ in range(20000)]
+        rng.shuffle(keys)
+        space_saving = topk.SpaceSaving(100)
+        space_saving.update(keys[:11000])
+        space_saving.update(keys[11000:])
+        exact = Counter(keys)
+        top = space_saving.most_common(2)
+        self.assertEqual([key for key, _ in top], ["hot", "warm"])
+        for key, count in top:
+            self.assertLessEqual(count - exact[key], len(keys) / 100)
+            self.assertGreaterEqual(count, exact[key])
+        self.assertLessEqual(len(space_saving.most_common()), 100)
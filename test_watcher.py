@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+import watcher as wt
+
+
+class FileWatcherTest(unittest.TestCase):
+    """
+    test case for file change notifications, with inotify when available and with stat polling
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "access.log")
+        open(self.path, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _check_notifications(self, file_watcher):
+        self.assertFalse(file_watcher.changed())
+        with open(os.path.join(self.directory, "other.log"), "w") as f:  # not watched
+            f.write("line\n")
+        self.assertFalse(file_watcher.changed())
+        with open(self.path, "a") as f:
+            f.write("line\n")
+        self.assertTrue(file_watcher.changed())
+        self.assertFalse(file_watcher.changed())
+        file_watcher.close()
+
+    def test_notifications(self):
+        """
+        Tests that only writes to watched files are notified
+        """
+        self._check_notifications(wt.FileWatcher([self.path]))
+
+    def test_polling(self):
+        """
+        Tests the stat polling fallback
+        """
+        original = wt._load_inotify
+        wt._load_inotify = lambda: None
+        try:
+            file_watcher = wt.FileWatcher([self.path])
+        finally:
+            wt._load_inotify = original
+        self.assertIsNone(file_watcher.fileno())
+        self._check_notifications(file_watcher)
@@ -0,0 +1,102 @@
+"""
+Top-k module
+Space-Saving heavy hitter tracking (Metwally, Agrawal, El Abbadi - 2005) with a fixed memory budget: at most
+`capacity` keys are monitored whatever the number of distinct keys in the stream.
+Error bounds, N being the number of hits counted since last clear():
+- every key with more than N / capacity hits is monitored
+- a monitored key's count overestimates its true count by at most its error, itself at most N / capacity
+"""
+import heapq
+from collections import Counter
+from collections.abc import Mapping
+
+
+class SpaceSaving:
+    """bounded-memory replacement for Counter when only the most common keys are needed"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._counts = {}  # {key: estimated hits} for monitored keys
+        self._errors = {}  # {key: maximum overestimation of its count}
+        self._heap = []  # (count, key) entries, possibly stale: used to find the key with the minimum count
+        self.total = 0  # number of hits counted since last clear
+
+    def _pop_min(self):
+        """
+        Removes the monitored key with the minimum count. Heap entries whose count is outdated are skipped
+        :return: (int) count of the removed key
+        """
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self._counts.get(key) == count:
+                del self._counts[key]
+                del self._errors[key]
+                return count
+
+    def _push(self, key, count):
+        """
+        Records the new count of a key in the heap, rebuilding it when stale entries take too much room
+        :return: None
+        """
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(value, monitored) for monitored, value in self._counts.items()]
+            heapq.heapify(self._heap)
+        else:
+            heapq.heappush(self._heap, (count, key))
+
+    def add(self, key, hits=1):
+        """
+        Counts hits for a key
+        :param key: (hashable) key to count
+        :param hits: (int) number of hits
+        :return: None
+        """
+        self.total += hits
+        if key in self._counts:
+            count = self._counts[key] + hits
+        elif len(self._counts) < self.capacity:
+            count = hits
+            self._errors[key] = 0
+        else:  # the new key takes the place of the least counted one and inherits its count as error
+            minimum = self._pop_min()
+            count = minimum + hits
+            self._errors[key] = minimum
+        self._counts[key] = count
+        self._push(key, count)
+
+    def update(self, iterable):
+        """
+        Counts every key of an iterable, same as Counter.update
+        :param iterable: (iterable or mapping) keys to count, one hit each, or {key: hits}
+        :return: None
+        """
+        counts = iterable if isinstance(iterable, Mapping) else Counter(iterable)  # keys are aggregated in C first
+        for key, hits in counts.items():
+            self.add(key, hits)
+
+    def most_common(self, n=None):
+        """
+        Returns the monitored keys with the highest estimated counts, same as Counter.most_common
+        :param n: (int) number of keys to return, all monitored keys if None
+        :return: (list) of tuples (key, estimated hits) ordered by hits
+        """
+        if n is None:
+            return sorted(self._counts.items(), key=lambda item: item[1], reverse=True)
+        return heapq.nlargest(n, self._counts.items(), key=lambda item: item[1])
+
+    def error(self, key):
+        """
+        :param key: (hashable) a monitored key
+        :return: (int) maximum overestimation of the key's count, 0 if it is exact
+        """
+        return self._errors.get(key, 0)
+
+    def clear(self):
+        """
+        Forgets every key
+        :return: None
+        """
+        self._counts.clear()
+        self._errors.clear()
+        self._heap = []
+        self.total = 0
@@ -0,0 +1,125 @@
+"""
+Watcher module
+Tells when log files have been written to, so that the monitor sleeps until there is something to read instead of
+polling. On Linux, inotify watches the directories of the log files (so that rotations and creations are seen too) and
+its file descriptor can be waited on with select. Elsewhere, files are stat-ed every POLL_INTERVAL seconds.
+"""
+import ctypes
+import ctypes.util
+import os
+import struct
+
+IN_MODIFY = 0x002
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+WATCH_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")  # struct inotify_event: wd, mask, cookie, len - followed by len bytes of name
+
+
+def _load_inotify():
+    """
+    :return: (ctypes.CDLL) libc if it provides inotify, None otherwise
+    """
+    library = ctypes.util.find_library("c")
+    if library is None:
+        return None
+    try:
+        libc = ctypes.CDLL(library, use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch  # raises AttributeError if not available
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FileWatcher:
+    """waits for writes, creations and rotations of a set of files"""
+    POLL_INTERVAL = 0.25  # seconds between two stat of the files when inotify is not available
+
+    def __init__(self, paths):
+        self._names = {}  # {directory: set of watched file names}
+        for path in paths:
+            directory, name = os.path.split(os.path.abspath(path))
+            self._names.setdefault(directory, set()).add(name.encode())
+        self._directories = {}  # {inotify watch descriptor: directory}
+        self._fd = None
+        self._stats = {}  # {path: (inode, size, mtime)} last seen when polling
+        self._paths = list(paths)
+        libc = _load_inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+                for directory in self._names:
+                    wd = libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)
+                    if wd < 0:  # e.g. directory doesn't exist: we can't be notified, fall back on polling
+                        self.close()
+                        break
+                    self._directories[wd] = directory
+        if self._fd is None:
+            self._poll_stats()
+
+    def fileno(self):
+        """
+        :return: (int) file descriptor readable when files changed, None when we have to poll
+        """
+        return self._fd
+
+    @property
+    def poll_interval(self):
+        """
+        :return: (float) how long to wait at most before calling changed(), None if fileno() can be waited on
+        """
+        return None if self._fd is not None else self.POLL_INTERVAL
+
+    def _poll_stats(self):
+        """
+        Stats every file and keeps the result
+        :return: (bool) True if any file changed since last call
+        """
+        changed = False
+        for path in self._paths:
+            try:
+                stat = os.stat(path)
+                current = (stat.st_ino, stat.st_size, stat.st_mtime)
+            except OSError:
+                current = None
+            if self._stats.get(path) != current:
+                self._stats[path] = current
+                changed = True
+        return changed
+
+    def changed(self):
+        """
+        Consumes pending notifications
+        :return: (bool) True if any watched file has been written to, created or moved since last call
+        """
+        if self._fd is None:
+            return self._poll_stats()
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                return changed
+            if not data:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if name in self._names.get(self._directories.get(wd), ()):
+                    changed = True
+
+    def close(self):
+        """
+        Stops watching
+        :return: None
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._directories.clear()
@@ -0,0 +1,106 @@
+"""
+Window module
+Event-time sliding window: hits are counted per second of the log timestamps in a fixed-size ring of buckets and the
+sum over the window is maintained incrementally, so that moving the window by one second costs O(1) whatever its
+length.
+"""
+
+
+class EventWindow:
+    """per-second hit counts over the last `length` seconds of event time, tolerating `lateness` seconds of disorder"""
+
+    def __init__(self, length, lateness=0):
+        self.length = length
+        self.lateness = lateness
+        self._size = length + lateness + 1  # closed window + seconds still open to late hits
+        self._buckets = [0] * self._size  # second s is stored at index s % self._size
+        self.total = 0  # running sum of hits over the closed window ]watermark - length, watermark]
+        self.head = None  # most recent second seen
+        self.watermark = None  # last closed second: hits at or before it are too late to be counted
+        self.late_hits = 0  # historic number of hits dropped because they were too late
+        self._closed = []  # (second, total) for every second closed since last call to pop_closed
+
+    def _close_until(self, second):
+        """
+        Closes every second up to the given one: it enters the window and the second that falls out of the window is
+        evicted
+        :param second: (int) new watermark
+        :return: None
+        """
+        if second - self.watermark > self._size:  # long gap: after self._size steps the whole ring is empty
+            for _ in range(self._size):
+                self._close_next()
+            self.watermark = second - 1
+        while self.watermark < second:
+            self._close_next()
+
+    def _close_next(self):
+        """
+        Closes the second following the watermark
+        :return: None
+        """
+        self.watermark += 1
+        self.total += self._buckets[self.watermark % self._size]
+        evicted = (self.watermark - self.length) % self._size
+        self.total -= self._buckets[evicted]
+        self._buckets[evicted] = 0  # slot is reused for second watermark + lateness + 1
+        self._closed.append((self.watermark, self.total))
+
+    def advance(self, second):
+        """
+        Moves event time forward: seconds older than second - lateness are closed
+        :param second: (int) current event time, in seconds since epoch
+        :return: None
+        """
+        if self.head is None:
+            self.head = second
+            self.watermark = second - self.lateness - 1
+        elif second > self.head:
+            self.head = second
+            self._close_until(second - self.lateness - 1)
+
+    def add(self, second, hits=1):
+        """
+        Counts hits at a given second
+        :param second: (int) event time of the hits, in seconds since epoch
+        :param hits: (int) number of hits
+        :return: (bool) False if the hits were too late and dropped
+        """
+        self.advance(second)
+        if second <= self.watermark:
+            self.late_hits += hits
+            return False
+        self._buckets[second % self._size] += hits
+        return True
+
+    def get_state(self):
+        """
+        :return: (dict) everything needed to rebuild the window, cf set_state. dict.keys() = ["length", "lateness",
+                 "head", "watermark", "total", "late_hits", "buckets"]
+        """
+        return {"length": self.length, "lateness": self.lateness, "head": self.head, "watermark": self.watermark,
+                "total": self.total, "late_hits": self.late_hits, "buckets": list(self._buckets)}
+
+    def set_state(self, state):
+        """
+        Restores a window saved with get_state, with the same length and lateness
+        :param state: (dict) returned by get_state
+        :return: (bool) False if the saved window doesn't have the same length and lateness and has been ignored
+        """
+        if (state["length"], state["lateness"]) != (self.length, self.lateness):
+            return False
+        self.head = state["head"]
+        self.watermark = state["watermark"]
+        self.total = state["total"]
+        self.late_hits = state["late_hits"]
+        self._buckets = list(state["buckets"])
+        self._closed = []
+        return True
+
+    def pop_closed(self):
+        """
+        Returns and forgets the seconds closed since last call
+        :return: (list) of tuples (second, total hits over the window ending at that second), in time order
+        """
+        closed, self._closed = self._closed, []
+        return closed